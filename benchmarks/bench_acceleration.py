@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+UNet加速模式基准测试
+在CPU上用小模型对比各加速模式 (ToMe / DeepCache) 相对不加速时的耗时和图像相似度
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gpu_server'))
+
+import numpy as np
+import torch
+from PIL import Image
+from diffusers import StableDiffusionImg2ImgPipeline
+from inference_backend import InferenceBackend
+from acceleration import Accelerator, ACCELERATION_MODES
+
+def load_pipeline(model: str, backend: InferenceBackend):
+    pipeline = StableDiffusionImg2ImgPipeline.from_pretrained(
+        model,
+        torch_dtype=backend.dtype,
+        safety_checker=None,
+        requires_safety_checker=False
+    )
+    pipeline.set_progress_bar_config(disable=True)
+    return backend.prepare_pipeline(pipeline)
+
+def make_input(width: int, height: int) -> Image.Image:
+    """平滑渐变的测试输入，比纯色图更接近照片"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    pixels = np.stack([128 + 100 * np.sin(x / width * 3.0 + c) * np.cos(y / height * 2.0 + c) for c in range(3)], axis=-1)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB')
+
+def run(pipeline, backend: InferenceBackend, accelerator: Accelerator, mode: str,
+        image: Image.Image, steps: int, runs: int, seed: int):
+    """以固定种子运行若干次生成，返回(每次耗时列表, 最后一次的输出图像)"""
+    durations = []
+    output = None
+    for _ in range(runs):
+        generator = torch.Generator('cpu').manual_seed(seed)
+        start = time.perf_counter()
+        with backend.autocast(), accelerator.apply(pipeline, mode):
+            output = pipeline(
+                prompt="a person wearing a business suit, high quality",
+                image=image,
+                strength=0.7,
+                num_inference_steps=steps,
+                generator=generator
+            ).images[0]
+        durations.append(time.perf_counter() - start)
+    return durations, output
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = np.mean((a - b) ** 2)
+    return float('inf') if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+def ssim(a: np.ndarray, b: np.ndarray, block: int = 8) -> float:
+    """灰度图按8x8块计算SSIM后取平均"""
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    a = a.mean(axis=-1)
+    b = b.mean(axis=-1)
+    h, w = (a.shape[0] // block) * block, (a.shape[1] // block) * block
+    a = a[:h, :w].reshape(h // block, block, w // block, block).swapaxes(1, 2).reshape(-1, block * block)
+    b = b[:h, :w].reshape(h // block, block, w // block, block).swapaxes(1, 2).reshape(-1, block * block)
+    mu_a, mu_b = a.mean(axis=1), b.mean(axis=1)
+    var_a, var_b = a.var(axis=1), b.var(axis=1)
+    cov = ((a - mu_a[:, None]) * (b - mu_b[:, None])).mean(axis=1)
+    scores = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(scores.mean())
+
+def main():
+    parser = argparse.ArgumentParser(description="UNet加速模式的加速比和图像相似度")
+    parser.add_argument('--model', default='segmind/tiny-sd', help="用于测试的模型(建议使用小模型)")
+    parser.add_argument('--width', type=int, default=512)
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--runs', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--modes', default=','.join(ACCELERATION_MODES[1:]), help="逗号分隔的加速模式")
+    parser.add_argument('--tome-ratio', type=float, default=0.5)
+    parser.add_argument('--deepcache-interval', type=int, default=3)
+    parser.add_argument('--output', help="结果JSON输出路径")
+    parser.add_argument('--save-images', help="保存各模式输出图像的目录")
+    args = parser.parse_args()
+
+    backend = InferenceBackend(device='cpu')
+    backend.setup()
+    accelerator = Accelerator(tome_ratio=args.tome_ratio, deepcache_interval=args.deepcache_interval)
+    pipeline = load_pipeline(args.model, backend)
+    image = make_input(args.width, args.height)
+
+    # 预热一次，排除首次调用的开销
+    run(pipeline, backend, accelerator, 'none', image, 2, 1, args.seed)
+
+    baseline_times, baseline_image = run(pipeline, backend, accelerator, 'none', image, args.steps, args.runs, args.seed)
+    baseline_pixels = np.asarray(baseline_image, dtype=np.float64)
+    results = {"none": {"mean_s": statistics.mean(baseline_times)}}
+    print(f"{'none':>16}: {results['none']['mean_s']:.2f} s")
+
+    outputs = {'none': baseline_image}
+    for requested in [m.strip() for m in args.modes.split(',') if m.strip()]:
+        mode = accelerator.resolve(requested)
+        if mode != requested:
+            print(f"{requested:>16}: 依赖未安装，跳过")
+            continue
+        durations, output = run(pipeline, backend, accelerator, mode, image, args.steps, args.runs, args.seed)
+        pixels = np.asarray(output, dtype=np.float64)
+        results[mode] = {
+            "mean_s": statistics.mean(durations),
+            "speedup": results["none"]["mean_s"] / statistics.mean(durations),
+            "psnr": psnr(baseline_pixels, pixels),
+            "ssim": ssim(baseline_pixels, pixels),
+        }
+        outputs[mode] = output
+        print(f"{mode:>16}: {results[mode]['mean_s']:.2f} s, 加速比 {results[mode]['speedup']:.2f}x, "
+              f"PSNR {results[mode]['psnr']:.1f} dB, SSIM {results[mode]['ssim']:.3f}")
+
+    if args.save_images:
+        os.makedirs(args.save_images, exist_ok=True)
+        for mode, output in outputs.items():
+            output.save(os.path.join(args.save_images, f"{mode.replace('+', '_')}.png"))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"model": args.model, "steps": args.steps, "accelerator": accelerator.describe(),
+                       "results": results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
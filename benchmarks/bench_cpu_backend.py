@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+CPU推理后端基准测试
+对比默认路径(fp32、无优化)与CPU优化后端的每步耗时
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gpu_server'))
+
+import torch
+from PIL import Image
+from diffusers import StableDiffusionImg2ImgPipeline
+from inference_backend import InferenceBackend
+
+def load_pipeline(model: str, backend: InferenceBackend):
+    """按后端配置加载管线"""
+    pipeline = StableDiffusionImg2ImgPipeline.from_pretrained(
+        model,
+        torch_dtype=backend.dtype,
+        safety_checker=None,
+        requires_safety_checker=False
+    )
+    pipeline.set_progress_bar_config(disable=True)
+    return backend.prepare_pipeline(pipeline)
+
+def measure_steps(pipeline, backend: InferenceBackend, image: Image.Image, steps: int, runs: int) -> list:
+    """运行若干次生成，返回每个去噪步的耗时(秒)
+
+    每次生成的第一个回调只作为计时起点：第一步之前还有文本编码、VAE编码和调度器初始化，
+    计入第一步会让结果偏高。因此每次生成记录 steps - 1 个步间耗时。
+    """
+    step_times = []
+
+    def on_step_end(pipe, step, timestep, callback_kwargs):
+        now = time.perf_counter()
+        if on_step_end.last is not None:
+            step_times.append(now - on_step_end.last)
+        on_step_end.last = now
+        return callback_kwargs
+
+    def run():
+        on_step_end.last = None
+        with backend.autocast():
+            pipeline(
+                prompt="a person wearing a business suit, high quality",
+                image=image,
+                strength=1.0,
+                num_inference_steps=steps,
+                callback_on_step_end=on_step_end
+            )
+
+    # 用相同参数完整预热一次，不计时，排除首次调用、内存分配和torch.compile的编译开销
+    run()
+    step_times.clear()
+
+    for _ in range(runs):
+        run()
+    return step_times
+
+def summarize(step_times: list) -> dict:
+    ordered = sorted(step_times)
+    return {
+        "steps": len(ordered),
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "median_ms": statistics.median(ordered) * 1000,
+        "p90_ms": ordered[int(len(ordered) * 0.9) - 1] * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU推理后端每步耗时对比")
+    parser.add_argument('--model', default='segmind/tiny-sd', help="用于测试的模型(建议使用小模型)")
+    parser.add_argument('--width', type=int, default=512)
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--runs', type=int, default=2)
+    parser.add_argument('--dtype', default='bf16', choices=['bf16', 'fp32'])
+    parser.add_argument('--threads', type=int, default=0)
+    parser.add_argument('--quantize', action='store_true', help="启用UNet/文本编码器动态int8量化")
+    parser.add_argument('--compile', action='store_true', help="启用torch.compile")
+    parser.add_argument('--output', help="结果JSON输出路径")
+    args = parser.parse_args()
+    if args.steps < 2:
+        parser.error("--steps至少为2 (每次生成的第一步不计时)")
+
+    image = Image.new('RGB', (args.width, args.height), color='gray')
+
+    variants = {
+        "default": InferenceBackend(device='cpu', cpu_dtype='fp32', cpu_threads=args.threads,
+                                    channels_last=False, quantize=False, torch_compile=False),
+        "optimized": InferenceBackend(device='cpu', cpu_dtype=args.dtype, cpu_threads=args.threads,
+                                      channels_last=True, quantize=args.quantize,
+                                      torch_compile=args.compile),
+    }
+
+    results = {}
+    for name, backend in variants.items():
+        backend.setup()
+        pipeline = load_pipeline(args.model, backend)
+        results[name] = {
+            "backend": backend.describe(),
+            **summarize(measure_steps(pipeline, backend, image, args.steps, args.runs)),
+        }
+        print(f"{name:>10}: {results[name]['mean_ms']:.1f} ms/step "
+              f"(median {results[name]['median_ms']:.1f}, p90 {results[name]['p90_ms']:.1f})")
+        del pipeline
+
+    speedup = results["default"]["mean_ms"] / results["optimized"]["mean_ms"]
+    results["speedup"] = speedup
+    print(f"加速比: {speedup:.2f}x")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    torch.manual_seed(0)
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+图像编解码与ImageProcessor热点路径微基准测试
+在多种真实照片尺寸下测量CPU侧每次请求都要付出的开销，输出JSON结果并可与基线对比
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'gpu_server'))
+
+import numpy as np
+from PIL import Image
+from utils.image_processing import ImageProcessor
+from services.ai_service import AIStyleTransferService
+import image_codec
+
+# 常见手机/相机照片尺寸 (宽, 高)
+PHOTO_SIZES = {
+    'vga': (640, 480),
+    'hd': (1280, 960),
+    'telegram': (1280, 1280),
+    '3mp': (2048, 1536),
+    '12mp': (4032, 3024),
+}
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'baseline.json')
+
+def make_photo(size, seed: int = 0) -> Image.Image:
+    """生成接近真实照片统计特性的测试图像 (平滑渐变 + 轻微噪声)，避免纯色图像让编码器过于轻松"""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        128 + 100 * np.sin(x / width * 3.0 + channel) * np.cos(y / height * 2.0 + channel)
+        for channel in range(3)
+    ], axis=-1)
+    noise = rng.normal(0, 8, size=(height, width, 3))
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8), 'RGB')
+
+def time_call(func, repeat: int, warmup: int = 1) -> dict:
+    """重复调用并统计耗时(毫秒)"""
+    for _ in range(warmup):
+        func()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return {
+        "runs": repeat,
+        "min_ms": min(durations),
+        "median_ms": statistics.median(durations),
+        "mean_ms": statistics.mean(durations),
+    }
+
+def build_cases(include_rembg: bool) -> dict:
+    """返回 {用例名: 接受图像并返回可调用对象的工厂}"""
+    processor = ImageProcessor()
+    service = AIStyleTransferService()
+
+    cases = {
+        'resize_image': lambda img: lambda: processor.resize_image(img),
+        'extract_person_mask': lambda img: lambda: processor.extract_person_mask(img),
+        'segment_clothing': lambda img: lambda: processor.segment_clothing(img),
+        'enhance_image': lambda img: lambda: processor.enhance_image(img),
+        'bot_image_to_base64': lambda img: lambda: service._image_to_base64(img),
+        'server_image_to_base64': lambda img: lambda: image_codec.image_to_base64(img),
+        'encode_for_delivery_jpeg': lambda img: lambda: processor.encode_for_delivery(img, 'JPEG'),
+        'encode_for_delivery_webp': lambda img: lambda: processor.encode_for_delivery(img, 'WEBP'),
+    }
+
+    def server_decode(img):
+        encoded = image_codec.image_to_base64(img)
+        return lambda: image_codec.base64_to_image(encoded)
+    cases['server_base64_to_image'] = server_decode
+
+    if include_rembg:
+        cases['remove_background'] = lambda img: lambda: processor.remove_background(img)
+    return cases
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """与基线对比中位数，返回超过阈值的回退项"""
+    regressions = []
+    print(f"\n{'用例':<40}{'基线(ms)':>12}{'当前(ms)':>12}{'变化':>10}")
+    for key, current in results.items():
+        previous = baseline.get('results', {}).get(key)
+        if previous is None:
+            continue
+        ratio = current['median_ms'] / previous['median_ms']
+        marker = ''
+        if ratio > 1 + threshold:
+            marker = '  ⚠️'
+            regressions.append(key)
+        print(f"{key:<40}{previous['median_ms']:>12.2f}{current['median_ms']:>12.2f}{(ratio - 1) * 100:>+9.1f}%{marker}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="图像编解码与预处理微基准")
+    parser.add_argument('--sizes', default=','.join(PHOTO_SIZES), help=f"测试尺寸，可选: {','.join(PHOTO_SIZES)}")
+    parser.add_argument('--cases', help="只运行指定用例，逗号分隔")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-rembg', action='store_true', help="跳过背景移除 (需要下载模型，耗时较长)")
+    parser.add_argument('--output', help="结果JSON输出路径")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="对比的基线文件")
+    parser.add_argument('--save-baseline', action='store_true', help="把本次结果保存为基线")
+    parser.add_argument('--threshold', type=float, default=0.10, help="判定为性能回退的相对变化")
+    args = parser.parse_args()
+
+    cases = build_cases(include_rembg=not args.skip_rembg)
+    if args.cases:
+        selected = args.cases.split(',')
+        cases = {name: factory for name, factory in cases.items() if name in selected}
+
+    results = {}
+    for size_name in args.sizes.split(','):
+        image = make_photo(PHOTO_SIZES[size_name])
+        for case_name, factory in cases.items():
+            key = f"{case_name}@{size_name}"
+            results[key] = time_call(factory(image), args.repeat)
+            print(f"{key:<40}{results[key]['median_ms']:>10.2f} ms")
+
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "pillow": Image.__version__,
+            "numpy": np.__version__,
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n基线已保存: {args.baseline}")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} 项超过 {args.threshold:.0%} 的回退阈值")
+            sys.exit(1)
+        print("\n✅ 没有超过阈值的性能回退")
+
+if __name__ == '__main__':
+    main()
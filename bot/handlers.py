@@ -1,23 +1,162 @@
 import logging
 import os
 import io
-from typing import Dict, Any
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import uuid
+import asyncio
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Tuple
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
 from telegram.ext import ContextTypes
 from PIL import Image
+from config import Config
 from utils.image_processing import ImageProcessor
 from services.ai_service import AIStyleTransferService, ClothingTemplateService
+from utils.tracing import create_tracer, span
 
 logger = logging.getLogger(__name__)
 
-# 全局服务实例
-image_processor = ImageProcessor()
-ai_service = AIStyleTransferService()
-template_service = ClothingTemplateService()
+# 全局服务实例，首次使用时创建 (测试时可直接替换模块属性)
+image_processor = None
+ai_service = None
+template_service = None
+tracer = create_tracer('telegram-bot', Config.TRACE_EXPORTER, Config.TRACE_FILE, Config.OTLP_ENDPOINT)
+
+# 后台预热线程和事件循环可能同时创建实例
+_services_lock = threading.Lock()
+
+def get_image_processor() -> ImageProcessor:
+    global image_processor
+    with _services_lock:
+        if image_processor is None:
+            image_processor = ImageProcessor()
+        return image_processor
+
+def get_ai_service() -> AIStyleTransferService:
+    global ai_service
+    with _services_lock:
+        if ai_service is None:
+            ai_service = AIStyleTransferService()
+        return ai_service
+
+def get_template_service() -> ClothingTemplateService:
+    global template_service
+    with _services_lock:
+        if template_service is None:
+            template_service = ClothingTemplateService()
+        return template_service
+
+def prewarm() -> None:
+    """后台预热：创建服务实例、加载背景移除模型并获取GPU服务器的分辨率桶"""
+    get_template_service()
+    get_image_processor().warmup()
+    service = get_ai_service()
+    if hasattr(service, 'get_resolution_buckets'):
+        service.get_resolution_buckets()
 
 # 用户状态管理
 user_sessions: Dict[int, Dict[str, Any]] = {}
 
+# 正在收集中的相册 (media_group_id -> 相册信息)
+pending_albums: Dict[str, Dict[str, Any]] = {}
+
+# 用户正在进行的生成任务 (user_id -> (任务ID, asyncio任务))
+active_jobs: Dict[int, Tuple[str, asyncio.Task]] = {}
+
+# 生成请求专用线程池：取消asyncio任务不会结束仍在等待GPU服务器响应的线程，
+# 这些线程在服务器处理中断后才返回，不能占用下载、预处理和编码所用的默认线程池
+generation_executor = ThreadPoolExecutor(max_workers=Config.MAX_CONCURRENT_GENERATIONS,
+                                         thread_name_prefix="generation")
+
+async def cancel_active_job(user_id: int) -> None:
+    """取消用户仍在进行的生成任务，旧结果已经没人需要，同时让GPU服务器中断它
+
+    GPU服务器中断任务后请求随即返回，正在等待响应的生成线程也随之结束。
+    """
+    job = active_jobs.pop(user_id, None)
+    if job is None:
+        return
+    job_id, task = job
+    task.cancel()
+    service = get_ai_service()
+    if hasattr(service, 'interrupt'):
+        await asyncio.to_thread(service.interrupt, job_id)
+    logger.info(f"已取消用户 {user_id} 的旧生成任务 {job_id}")
+
+async def run_generation(user_id: int, func, *args, **kwargs):
+    """在线程中运行生成任务并登记为用户的当前任务，同一用户的新任务会取消旧任务"""
+    await cancel_active_job(user_id)
+    job_id = uuid.uuid4().hex
+    loop = asyncio.get_running_loop()
+    # 与asyncio.to_thread一样复制上下文，生成请求沿用当前的追踪span
+    call = functools.partial(contextvars.copy_context().run, func, *args, job_id=job_id, **kwargs)
+    task = asyncio.ensure_future(loop.run_in_executor(generation_executor, call))
+    active_jobs[user_id] = (job_id, task)
+    try:
+        return await task
+    finally:
+        if user_id in active_jobs and active_jobs[user_id][0] == job_id:
+            del active_jobs[user_id]
+
+def reset_session(user_id: int, key: str, value: Any) -> None:
+    """生成完成后重置用户状态
+
+    生成和上传期间用户可能已经发送了新照片，只有会话中仍是本次生成所用的照片时才重置。
+    """
+    session = user_sessions.get(user_id)
+    if session is not None and session.get(key) is value:
+        user_sessions[user_id] = {'state': 'waiting_for_image'}
+
+def encode_result(image: Image.Image) -> bytes:
+    """把结果编码为体积受控的JPEG/WebP"""
+    return get_image_processor().encode_for_delivery(
+        image, Config.RESULT_FORMAT, Config.RESULT_MAX_BYTES, Config.RESULT_MAX_SIDE
+    )
+
+async def send_result_photo(context: ContextTypes.DEFAULT_TYPE, chat_id: int,
+                            image: Image.Image, caption: str) -> None:
+    """发送单张结果，编码放到线程中避免阻塞事件循环"""
+    photo = await asyncio.to_thread(encode_result, image)
+    await context.bot.send_photo(chat_id=chat_id, photo=photo, caption=caption)
+
+async def send_result_album(context: ContextTypes.DEFAULT_TYPE, chat_id: int,
+                            images: List[Image.Image], caption: str) -> None:
+    """以相册形式发送多张结果，首张带说明文字"""
+    photos = await asyncio.gather(*(asyncio.to_thread(encode_result, image) for image in images))
+    media = [InputMediaPhoto(media=photo, caption=caption if i == 0 else None)
+             for i, photo in enumerate(photos)]
+    await context.bot.send_media_group(chat_id=chat_id, media=media)
+
+def build_style_keyboard() -> InlineKeyboardMarkup:
+    """创建风格选择键盘"""
+    keyboard = []
+    styles = get_template_service().get_available_styles()
+    
+    for i in range(0, len(styles), 2):
+        row = []
+        row.append(InlineKeyboardButton(
+            f"🎽 {styles[i].title()}", 
+            callback_data=f"style_{styles[i]}"
+        ))
+        if i + 1 < len(styles):
+            row.append(InlineKeyboardButton(
+                f"👔 {styles[i+1].title()}", 
+                callback_data=f"style_{styles[i+1]}"
+            ))
+        keyboard.append(row)
+    
+    return InlineKeyboardMarkup(keyboard)
+
+async def download_photo(context: ContextTypes.DEFAULT_TYPE, file_id: str) -> Image.Image:
+    """下载照片到内存并转换为PIL图像"""
+    file = await context.bot.get_file(file_id)
+    photo_bytes = io.BytesIO()
+    await file.download_to_memory(photo_bytes)
+    photo_bytes.seek(0)
+    return Image.open(photo_bytes).convert('RGB')
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """处理/start命令"""
     user_id = update.effective_user.id
@@ -44,6 +183,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     
     await update.message.reply_text(welcome_text)
 
+@tracer.traced("handle_photo")
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """处理用户上传的照片"""
     user_id = update.effective_user.id
@@ -51,50 +191,34 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     if user_id not in user_sessions:
         user_sessions[user_id] = {}
     
+    # 新照片到达后，之前照片的生成结果不再需要
+    await cancel_active_job(user_id)
+    
+    # 相册中的照片先收集起来，整组一起处理
+    if update.message.media_group_id:
+        collect_album_photo(update, context)
+        return
+    
     try:
         # 下载照片
         photo = update.message.photo[-1]  # 获取最高质量的照片
-        file = await context.bot.get_file(photo.file_id)
-        
-        # 下载到内存
-        photo_bytes = io.BytesIO()
-        await file.download_to_memory(photo_bytes)
-        photo_bytes.seek(0)
-        
-        # 转换为PIL图像
-        user_image = Image.open(photo_bytes).convert('RGB')
+        with span("download"):
+            user_image = await download_photo(context, photo.file_id)
         
         # 预处理图像
-        user_image = image_processor.resize_image(user_image)
-        user_image = image_processor.remove_background(user_image)
+        with span("preprocess"):
+            user_image = get_image_processor().resize_image(user_image)
+            user_image = get_image_processor().remove_background(user_image)
         
         # 保存到用户会话
         user_sessions[user_id]['original_image'] = user_image
+        user_sessions[user_id].pop('album_images', None)
         user_sessions[user_id]['state'] = 'image_received'
         
-        # 创建风格选择键盘
-        keyboard = []
-        styles = template_service.get_available_styles()
-        
-        for i in range(0, len(styles), 2):
-            row = []
-            row.append(InlineKeyboardButton(
-                f"🎽 {styles[i].title()}", 
-                callback_data=f"style_{styles[i]}"
-            ))
-            if i + 1 < len(styles):
-                row.append(InlineKeyboardButton(
-                    f"👔 {styles[i+1].title()}", 
-                    callback_data=f"style_{styles[i+1]}"
-                ))
-            keyboard.append(row)
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
         await update.message.reply_text(
             "📸 照片接收成功！已完成背景处理。\n\n"
             "🎨 请选择您想要的换装风格：",
-            reply_markup=reply_markup
+            reply_markup=build_style_keyboard()
         )
         
     except Exception as e:
@@ -104,6 +228,63 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             "确保照片清晰且文件大小适中。"
         )
 
+def collect_album_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """收集相册照片，最后一张到达后等待片刻再整组处理"""
+    group_id = update.message.media_group_id
+    album = pending_albums.setdefault(group_id, {
+        'user_id': update.effective_user.id,
+        'message': update.message,
+        'file_ids': [],
+        'task': None
+    })
+    album['file_ids'].append(update.message.photo[-1].file_id)
+    
+    # 每收到一张照片就重新计时
+    if album['task'] is not None:
+        album['task'].cancel()
+    album['task'] = asyncio.create_task(process_album(group_id, context))
+
+async def process_album(group_id: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """整组下载并批量预处理相册照片"""
+    await asyncio.sleep(Config.ALBUM_COLLECT_DELAY)
+    album = pending_albums.pop(group_id, None)
+    if album is None:
+        return
+    
+    with tracer.trace("handle_album", media_group_id=group_id, photos=len(album['file_ids'])):
+        await preprocess_album(album, context)
+
+async def preprocess_album(album: Dict[str, Any], context: ContextTypes.DEFAULT_TYPE) -> None:
+    """下载并预处理相册，完成后显示风格选择"""
+    user_id = album['user_id']
+    message = album['message']
+    
+    try:
+        with span("download"):
+            images = await asyncio.gather(*(download_photo(context, file_id) for file_id in album['file_ids']))
+        
+        # 批量预处理，放到线程中避免阻塞事件循环
+        with span("preprocess"):
+            images = await asyncio.to_thread(get_image_processor().preprocess_batch, list(images))
+        
+        session = user_sessions.setdefault(user_id, {})
+        session['album_images'] = images
+        session['original_image'] = images[0]
+        session['state'] = 'image_received'
+        
+        await message.reply_text(
+            f"📸 已接收相册中的 {len(images)} 张照片！已完成背景处理。\n\n"
+            "🎨 请选择您想要的换装风格 (将应用到所有照片)：",
+            reply_markup=build_style_keyboard()
+        )
+        
+    except Exception as e:
+        logger.error(f"处理相册时出错: {e}")
+        await message.reply_text(
+            "❌ 处理相册时出现错误，请重新发送照片。\n"
+            "确保照片清晰且文件大小适中。"
+        )
+
 async def handle_style_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """处理风格选择回调"""
     query = update.callback_query
@@ -120,7 +301,7 @@ async def handle_style_selection(update: Update, context: ContextTypes.DEFAULT_T
     user_sessions[user_id]['selected_style'] = style
     
     # 获取该风格的服装选项
-    clothing_options = template_service.get_clothing_prompts(style)
+    clothing_options = get_template_service().get_clothing_prompts(style)
     
     # 创建服装选择键盘
     keyboard = []
@@ -141,6 +322,7 @@ async def handle_style_selection(update: Update, context: ContextTypes.DEFAULT_T
         reply_markup=reply_markup
     )
 
+@tracer.traced("handle_clothing_selection")
 async def handle_clothing_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """处理具体服装选择"""
     query = update.callback_query
@@ -157,41 +339,92 @@ async def handle_clothing_selection(update: Update, context: ContextTypes.DEFAUL
     clothing_index = int(parts[1])
     style = parts[2]
     
-    clothing_options = template_service.get_clothing_prompts(style)
+    clothing_options = get_template_service().get_clothing_prompts(style)
     selected_clothing = clothing_options[clothing_index]
     
     user_sessions[user_id]['selected_clothing'] = selected_clothing
     
     await query.edit_message_text("🔄 正在生成您的换装效果，请稍候...")
     
+    # 相册走批量生成
+    if 'album_images' in user_sessions[user_id]:
+        await generate_album(update, context, user_id, style, selected_clothing)
+        return
+    
     # 开始AI处理
     try:
         original_image = user_sessions[user_id]['original_image']
         
-        # 使用AI服务生成换装效果
-        result_image = ai_service.generate_outfit_change(
+        # 使用AI服务生成换装效果，放到线程中避免阻塞事件循环
+        result_image = await run_generation(
+            user_id,
+            get_ai_service().generate_outfit_change,
             person_image=original_image,
             clothing_prompt=selected_clothing,
             style_prompt=f"{style} style"
         )
         
         if result_image:
-            # 转换为字节流发送
-            output_buffer = io.BytesIO()
-            result_image.save(output_buffer, format='PNG')
-            output_buffer.seek(0)
+            with span("telegram_upload"):
+                await send_result_photo(
+                    context,
+                    query.message.chat_id,
+                    result_image,
+                    caption=f"✨ 换装完成！\n\n"
+                           f"🎨 风格: {style.title()}\n"
+                           f"👔 服装: {selected_clothing}\n\n"
+                           f"💡 发送新照片继续体验！"
+                )
+            
+            # 重置用户状态
+            reset_session(user_id, 'original_image', original_image)
             
-            await context.bot.send_photo(
+        else:
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
-                photo=output_buffer,
-                caption=f"✨ 换装完成！\n\n"
-                       f"🎨 风格: {style.title()}\n"
-                       f"👔 服装: {selected_clothing}\n\n"
-                       f"💡 发送新照片继续体验！"
+                text="❌ 生成换装效果失败，请稍后再试。\n"
+                     "可能是AI服务暂时不可用。"
             )
             
+    except asyncio.CancelledError:
+        # 用户发送了新照片或选择了其他服装，结果不再发送
+        logger.info(f"用户 {user_id} 的生成任务已被新请求取代")
+    except Exception as e:
+        logger.error(f"AI处理失败: {e}")
+        await context.bot.send_message(
+            chat_id=query.message.chat_id,
+            text="❌ 处理过程中出现错误，请重新尝试。"
+        )
+
+async def generate_album(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                         user_id: int, style: str, selected_clothing: str) -> None:
+    """对整个相册使用同一服装选择批量生成，并以相册形式返回"""
+    query = update.callback_query
+    album_images: List[Image.Image] = user_sessions[user_id]['album_images']
+    
+    try:
+        result_images = await run_generation(
+            user_id,
+            get_ai_service().generate_outfit_change_batch,
+            album_images,
+            selected_clothing,
+            f"{style} style"
+        )
+        
+        if result_images:
+            with span("telegram_upload", photos=len(result_images)):
+                await send_result_album(
+                    context,
+                    query.message.chat_id,
+                    result_images,
+                    caption=f"✨ 换装完成！\n\n"
+                           f"🎨 风格: {style.title()}\n"
+                           f"👔 服装: {selected_clothing}\n\n"
+                           f"💡 发送新照片继续体验！"
+                )
+            
             # 重置用户状态
-            user_sessions[user_id] = {'state': 'waiting_for_image'}
+            reset_session(user_id, 'album_images', album_images)
             
         else:
             await context.bot.send_message(
@@ -200,8 +433,10 @@ async def handle_clothing_selection(update: Update, context: ContextTypes.DEFAUL
                      "可能是AI服务暂时不可用。"
             )
             
+    except asyncio.CancelledError:
+        logger.info(f"用户 {user_id} 的相册生成任务已被新请求取代")
     except Exception as e:
-        logger.error(f"AI处理失败: {e}")
+        logger.error(f"相册AI处理失败: {e}")
         await context.bot.send_message(
             chat_id=query.message.chat_id,
             text="❌ 处理过程中出现错误，请重新尝试。"
@@ -213,27 +448,9 @@ async def handle_back_to_styles(update: Update, context: ContextTypes.DEFAULT_TY
     await query.answer()
     
     # 重新显示风格选择
-    keyboard = []
-    styles = template_service.get_available_styles()
-    
-    for i in range(0, len(styles), 2):
-        row = []
-        row.append(InlineKeyboardButton(
-            f"🎽 {styles[i].title()}", 
-            callback_data=f"style_{styles[i]}"
-        ))
-        if i + 1 < len(styles):
-            row.append(InlineKeyboardButton(
-                f"👔 {styles[i+1].title()}", 
-                callback_data=f"style_{styles[i+1]}"
-            ))
-        keyboard.append(row)
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
     await query.edit_message_text(
         "🎨 请选择您想要的换装风格：",
-        reply_markup=reply_markup
+        reply_markup=build_style_keyboard()
     )
 
 async def handle_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -274,11 +491,11 @@ async def handle_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     status_text = "🔍 正在检查服务状态...\n\n"
     
     # 检查AI服务
-    ai_status = "✅ 正常" if ai_service.check_service_health() else "❌ 不可用"
+    ai_status = "✅ 正常" if get_ai_service().check_service_health() else "❌ 不可用"
     
     status_text += f"🤖 AI服务: {ai_status}\n"
     status_text += f"📊 活跃用户: {len(user_sessions)}\n"
-    status_text += f"🎨 可用风格: {len(template_service.get_available_styles())}\n"
+    status_text += f"🎨 可用风格: {len(get_template_service().get_available_styles())}\n"
     
     await update.message.reply_text(status_text)
 
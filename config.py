@@ -9,6 +9,8 @@ class Config:
     
     # GPU服务器配置
     GPU_SERVER_URL = os.getenv('GPU_SERVER_URL', 'http://localhost:7860')
+    # 与GPU服务器同机部署时的本机传输套接字 (GPU服务的SD_LOCAL_SOCKET)，不存在时使用HTTP
+    GPU_LOCAL_SOCKET = os.getenv('GPU_LOCAL_SOCKET')
     
     # 文件存储配置
     UPLOAD_DIR = './uploads'
@@ -16,16 +18,51 @@ class Config:
     TEMP_DIR = './temp'
     
     # AI模型配置
-    STABLE_DIFFUSION_MODEL = 'runwayml/stable-diffusion-v1-5'
-    CONTROLNET_MODEL = 'lllyasviel/sd-controlnet-openpose'
+    # 生成时请求的checkpoint，需在GPU服务器的SD_MODELS列表中
+    STABLE_DIFFUSION_MODEL = os.getenv('STABLE_DIFFUSION_MODEL', 'runwayml/stable-diffusion-v1-5')
+    # 生成质量档位 (high/balanced/fast)，不设置时使用GPU服务器的默认加速模式
+    GENERATION_QUALITY = os.getenv('GENERATION_QUALITY')
+    # 输出放大倍数，大于1时在基础分辨率生成后放大 (两阶段生成)，HIRES_STEPS为放大后的细化步数
+    OUTPUT_SCALE = float(os.getenv('OUTPUT_SCALE', '1.0'))
+    HIRES_UPSCALER = os.getenv('HIRES_UPSCALER', 'Latent')
+    HIRES_STEPS = int(os.getenv('HIRES_STEPS', '10'))
     
     # 图像处理配置
     MAX_IMAGE_SIZE = (1024, 1024)
+    # GPU服务器不支持分辨率桶时使用的生成尺寸
+    DEFAULT_RESOLUTION = (512, 768)
+    # 获取分辨率桶失败后的重试间隔 (秒)
+    BUCKET_RETRY_INTERVAL = 60
     SUPPORTED_FORMATS = ['jpg', 'jpeg', 'png', 'webp']
+    # 相册照片收集等待时间 (秒)
+    ALBUM_COLLECT_DELAY = 1.5
+    # 每个生成请求最多包含的照片数，相册按分辨率桶分组后再按此拆分，避免GPU显存不足
+    MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '4'))
+    # 同时等待GPU服务器响应的生成请求数上限
+    MAX_CONCURRENT_GENERATIONS = int(os.getenv('MAX_CONCURRENT_GENERATIONS', '16'))
+    # 结果图像发送格式 (jpeg/webp) 和体积上限，Telegram会重新压缩照片，无需上传PNG
+    RESULT_FORMAT = os.getenv('RESULT_FORMAT', 'jpeg')
+    RESULT_MAX_BYTES = int(os.getenv('RESULT_MAX_BYTES', str(800 * 1024)))
+    RESULT_MAX_SIDE = 2560
     
     # 服务器配置
     HOST = '0.0.0.0'
     PORT = 8000
     
+    # 拉取式任务队列配置 (启用后生成任务写入本地SQLite队列，由GPU worker领取)
+    JOB_QUEUE_ENABLED = os.getenv('JOB_QUEUE_ENABLED', 'false').lower() == 'true'
+    JOB_QUEUE_DB = os.getenv('JOB_QUEUE_DB', './temp/jobs.db')
+    JOB_QUEUE_PORT = int(os.getenv('JOB_QUEUE_PORT', '8001'))
+    JOB_QUEUE_TOKEN = os.getenv('JOB_QUEUE_TOKEN')
+    JOB_QUEUE_LEASE_SECONDS = 30
+    JOB_QUEUE_MAX_ATTEMPTS = 3
+    # 已结束任务的保留时间 (秒)
+    JOB_QUEUE_RETENTION_SECONDS = 3600
+    
     # 日志配置
-    LOG_LEVEL = 'INFO'
\ No newline at end of file
+    LOG_LEVEL = 'INFO'
+    
+    # 请求追踪配置 (none / file / otlp)
+    TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', 'none')
+    TRACE_FILE = os.getenv('TRACE_FILE', './temp/traces.jsonl')
+    OTLP_ENDPOINT = os.getenv('OTLP_ENDPOINT', 'http://localhost:4318')
\ No newline at end of file
@@ -0,0 +1,94 @@
+import os
+import contextlib
+import importlib.util
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# 可选的加速模式，可以用 "+" 组合
+ACCELERATION_MODES = ('none', 'tome', 'deepcache', 'tome+deepcache')
+
+# 质量档位对应的加速模式
+QUALITY_TIERS = {
+    'high': 'none',
+    'balanced': 'tome',
+    'fast': 'tome+deepcache',
+}
+
+def _installed(package: str) -> bool:
+    return importlib.util.find_spec(package) is not None
+
+class Accelerator:
+    """UNet加速模式，用少量保真度换取更高吞吐
+
+    - tome: Token Merging，在注意力块中合并相似的token (依赖可选包tomesd)
+    - deepcache: 在相邻去噪步之间复用深层UNet特征，只重新计算浅层分支 (依赖可选包DeepCache)
+
+    管线在多个请求之间共享，补丁只在一次生成期间生效，结束后恢复。
+    未安装对应的包时该模式自动退化为不加速。
+    """
+    def __init__(self,
+                 default_mode: str = None,
+                 tome_ratio: float = None,
+                 deepcache_interval: int = None,
+                 deepcache_branch: int = None):
+        self.default_mode = (default_mode or os.getenv('SD_ACCELERATION', 'none')).lower()
+        self.tome_ratio = tome_ratio if tome_ratio is not None else float(os.getenv('SD_TOME_RATIO', '0.5'))
+        self.deepcache_interval = deepcache_interval or int(os.getenv('SD_DEEPCACHE_INTERVAL', '3'))
+        self.deepcache_branch = deepcache_branch if deepcache_branch is not None else int(os.getenv('SD_DEEPCACHE_BRANCH', '0'))
+        self.available = {
+            'tome': _installed('tomesd'),
+            'deepcache': _installed('DeepCache'),
+        }
+        if self.default_mode not in ACCELERATION_MODES:
+            raise ValueError(f"不支持的加速模式: {self.default_mode}，可选: {list(ACCELERATION_MODES)}")
+
+    def resolve(self, mode: Optional[str] = None, quality: Optional[str] = None) -> str:
+        """确定请求实际使用的加速模式：显式指定的模式优先，其次是质量档位，最后是默认模式"""
+        if mode is None and quality is not None:
+            if quality not in QUALITY_TIERS:
+                raise ValueError(f"未知的质量档位: {quality}，可选: {list(QUALITY_TIERS)}")
+            mode = QUALITY_TIERS[quality]
+        mode = (mode or self.default_mode).lower()
+        if mode not in ACCELERATION_MODES:
+            raise ValueError(f"不支持的加速模式: {mode}，可选: {list(ACCELERATION_MODES)}")
+
+        parts = [part for part in mode.split('+') if part != 'none']
+        missing = [part for part in parts if not self.available[part]]
+        if missing:
+            logger.warning(f"加速模式 {missing} 的依赖未安装，已跳过")
+        parts = [part for part in parts if self.available[part]]
+        return '+'.join(parts) or 'none'
+
+    @contextlib.contextmanager
+    def apply(self, pipeline, mode: str):
+        """在一次生成期间为管线打上加速补丁 (mode应为resolve()的返回值)"""
+        parts = mode.split('+')
+        undo = []
+        try:
+            if 'tome' in parts:
+                import tomesd
+                tomesd.apply_patch(pipeline, ratio=self.tome_ratio)
+                undo.append(lambda: tomesd.remove_patch(pipeline))
+            if 'deepcache' in parts:
+                from DeepCache import DeepCacheSDHelper
+                helper = DeepCacheSDHelper(pipe=pipeline)
+                helper.set_params(cache_interval=self.deepcache_interval, cache_branch_id=self.deepcache_branch)
+                helper.enable()
+                undo.append(helper.disable)
+            yield
+        finally:
+            for restore in reversed(undo):
+                restore()
+
+    def describe(self) -> dict:
+        """返回加速配置，用于健康检查"""
+        return {
+            "default": self.default_mode,
+            "available": self.available,
+            "tome_ratio": self.tome_ratio,
+            "deepcache_interval": self.deepcache_interval,
+            "deepcache_branch": self.deepcache_branch,
+            "quality_tiers": QUALITY_TIERS,
+        }
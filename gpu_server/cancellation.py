@@ -0,0 +1,110 @@
+import time
+import uuid
+import logging
+import threading
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class GenerationCancelled(Exception):
+    """生成任务被中断、客户端已断开或超过截止时间"""
+
+class CancelToken:
+    """单个生成任务的取消标记，在排队结束和每个去噪步检查"""
+    def __init__(self, job_id: str, timeout: Optional[float] = None):
+        self.job_id = job_id
+        self.created = time.monotonic()
+        self.deadline = self.created + timeout if timeout else None
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+
+    def cancel(self, reason: str):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def age(self) -> float:
+        """任务到达以来经过的秒数"""
+        return time.monotonic() - self.created
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def check(self):
+        """已取消或超时则抛出GenerationCancelled"""
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.cancel("客户端超时")
+        if self._event.is_set():
+            raise GenerationCancelled(f"任务 {self.job_id} 已取消: {self.reason}")
+
+    def step_callback(self, pipeline, step: int, timestep, callback_kwargs: dict) -> dict:
+        """diffusers的callback_on_step_end，每个去噪步结束时检查是否需要中断"""
+        self.check()
+        return callback_kwargs
+
+class CancellationRegistry:
+    """跟踪排队中和运行中的生成任务，支持按任务ID中断 (兼容Automatic1111的/sdapi/v1/interrupt)"""
+    # 尚未到达的任务被提前取消时，记录保留的秒数
+    PENDING_TTL = 300
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, CancelToken] = {}
+        self._precancelled: Dict[str, float] = {}
+        self.running: Optional[CancelToken] = None
+
+    def register(self, job_id: Optional[str] = None, timeout: Optional[float] = None) -> CancelToken:
+        """为新任务创建取消标记"""
+        token = CancelToken(job_id or uuid.uuid4().hex, timeout)
+        with self._lock:
+            self._prune()
+            if self._precancelled.pop(token.job_id, None) is not None:
+                token.cancel("已被客户端取消")
+            self._tokens[token.job_id] = token
+        return token
+
+    def start(self, token: CancelToken):
+        """任务获得生成锁，开始运行；排队期间已被取消的任务直接丢弃"""
+        token.check()
+        with self._lock:
+            self.running = token
+
+    def finish(self, token: CancelToken):
+        """释放任务的取消标记，可以重复调用"""
+        with self._lock:
+            if self._tokens.get(token.job_id) is token:
+                del self._tokens[token.job_id]
+            if self.running is token:
+                self.running = None
+
+    def interrupt(self, job_id: Optional[str] = None, reason: str = "已被客户端取消") -> bool:
+        """中断指定任务；未指定时中断当前正在运行的任务"""
+        with self._lock:
+            if job_id is None:
+                token = self.running
+            else:
+                token = self._tokens.get(job_id)
+                if token is None:
+                    # 中断请求先于任务到达，任务到达时直接丢弃
+                    self._precancelled[job_id] = time.monotonic()
+                    return False
+        if token is None:
+            return False
+        token.cancel(reason)
+        logger.info(f"任务 {token.job_id} 已请求中断: {reason}")
+        return True
+
+    def _prune(self):
+        now = time.monotonic()
+        for job_id, cancelled_at in list(self._precancelled.items()):
+            if now - cancelled_at > self.PENDING_TTL:
+                del self._precancelled[job_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued": sum(1 for token in self._tokens.values() if token is not self.running),
+                "running": self.running.job_id if self.running else None,
+            }
@@ -0,0 +1,88 @@
+import os
+import math
+import torch
+import torch.nn.functional as F
+from typing import List, Optional
+from PIL import Image
+
+# 放大方式 (名称兼容Automatic1111的hr_upscaler，大小写不敏感)
+# latent类在潜空间插值，之后通常需要细化pass；像素类在CPU上解码后放大
+LATENT_UPSCALERS = {
+    'latent': 'bilinear',
+    'latent (bicubic)': 'bicubic',
+    'latent (nearest)': 'nearest-exact',
+}
+PIXEL_UPSCALERS = {
+    'lanczos': Image.Resampling.LANCZOS,
+    'bicubic': Image.Resampling.BICUBIC,
+}
+
+# 输出像素数上限，避免细化pass耗尽显存
+MAX_OUTPUT_PIXELS = int(os.getenv('SD_HIRES_MAX_PIXELS', str(1536 * 2048)))
+
+class HiresPlan:
+    """两阶段生成：在基础分辨率去噪，放大到输出分辨率，再可选地用少量步数细化"""
+    def __init__(self, width: int, height: int, upscaler: str, steps: int, denoising_strength: float):
+        self.width = width
+        self.height = height
+        self.upscaler = upscaler
+        self.steps = steps
+        self.denoising_strength = denoising_strength
+
+    @property
+    def is_latent(self) -> bool:
+        return self.upscaler in LATENT_UPSCALERS
+
+    @property
+    def num_inference_steps(self) -> int:
+        """img2img只运行 num_inference_steps * strength 步，按实际需要的细化步数反推"""
+        return math.ceil(self.steps / self.denoising_strength)
+
+    def describe(self) -> dict:
+        return {
+            "width": self.width,
+            "height": self.height,
+            "upscaler": self.upscaler,
+            "steps": self.steps,
+            "denoising_strength": self.denoising_strength,
+        }
+
+def _round8(value: float) -> int:
+    return max(8, int(round(value / 8)) * 8)
+
+def plan_hires(request) -> Optional[HiresPlan]:
+    """根据请求的hires参数计算输出分辨率，未启用或不需要放大时返回None"""
+    if not request.enable_hr:
+        return None
+
+    upscaler = request.hr_upscaler.lower()
+    if upscaler not in LATENT_UPSCALERS and upscaler not in PIXEL_UPSCALERS:
+        raise ValueError(f"不支持的放大方式: {request.hr_upscaler}，"
+                         f"可选: {list(LATENT_UPSCALERS) + list(PIXEL_UPSCALERS)}")
+    if not 0 < request.hr_denoising_strength <= 1:
+        raise ValueError("hr_denoising_strength需要在(0, 1]之间")
+
+    # 只指定一边时按基础分辨率的宽高比计算另一边
+    if request.hr_resize_x or request.hr_resize_y:
+        width = request.hr_resize_x or request.hr_resize_y * request.width / request.height
+        height = request.hr_resize_y or request.hr_resize_x * request.height / request.width
+    else:
+        width = request.width * request.hr_scale
+        height = request.height * request.hr_scale
+    width, height = _round8(width), _round8(height)
+
+    if width * height > MAX_OUTPUT_PIXELS:
+        raise ValueError(f"输出分辨率 {width}x{height} 超过上限 ({MAX_OUTPUT_PIXELS} 像素)")
+    if width <= request.width and height <= request.height:
+        return None
+
+    return HiresPlan(width, height, upscaler, request.hr_second_pass_steps, request.hr_denoising_strength)
+
+def upscale_latents(latents: torch.Tensor, plan: HiresPlan) -> torch.Tensor:
+    """在潜空间插值放大，比在像素空间以全尺寸去噪便宜得多"""
+    return F.interpolate(latents, size=(plan.height // 8, plan.width // 8), mode=LATENT_UPSCALERS[plan.upscaler])
+
+def upscale_images(images: List[Image.Image], plan: HiresPlan) -> List[Image.Image]:
+    """解码后在CPU上放大"""
+    resample = PIXEL_UPSCALERS[plan.upscaler]
+    return [image.resize((plan.width, plan.height), resample) for image in images]
@@ -0,0 +1,15 @@
+import io
+import base64
+from PIL import Image
+
+def base64_to_image(base64_str: str) -> Image.Image:
+    """将base64转换为PIL图像"""
+    img_data = base64.b64decode(base64_str)
+    image = Image.open(io.BytesIO(img_data))
+    return image.convert('RGB')
+
+def image_to_base64(image: Image.Image) -> str:
+    """将PIL图像转换为base64"""
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode()
@@ -0,0 +1,116 @@
+import os
+import contextlib
+import logging
+import torch
+
+logger = logging.getLogger(__name__)
+
+# 支持的CPU精度
+CPU_DTYPES = {
+    'bf16': torch.bfloat16,
+    'fp32': torch.float32,
+}
+
+def _env_flag(name: str, default: str = '0') -> bool:
+    """读取布尔型环境变量"""
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+class InferenceBackend:
+    """推理后端配置，统一管理设备、精度和CPU优化选项"""
+    def __init__(self,
+                 device: str = None,
+                 cpu_dtype: str = None,
+                 cpu_threads: int = None,
+                 channels_last: bool = None,
+                 quantize: bool = None,
+                 torch_compile: bool = None):
+        requested = (device or os.getenv('SD_DEVICE', 'auto')).lower()
+        if requested == 'auto':
+            requested = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = requested
+
+        self.cpu_dtype = (cpu_dtype or os.getenv('SD_CPU_DTYPE', 'bf16')).lower()
+        if self.cpu_dtype not in CPU_DTYPES:
+            raise ValueError(f"不支持的CPU精度: {self.cpu_dtype}，可选: {list(CPU_DTYPES)}")
+
+        self.cpu_threads = cpu_threads if cpu_threads is not None else int(os.getenv('SD_CPU_THREADS', '0'))
+        self.channels_last = channels_last if channels_last is not None else _env_flag('SD_CHANNELS_LAST', '1')
+        self.quantize = quantize if quantize is not None else _env_flag('SD_CPU_QUANTIZE')
+        self.torch_compile = torch_compile if torch_compile is not None else _env_flag('SD_TORCH_COMPILE')
+
+        # 动态int8量化只支持fp32权重
+        if self.is_cpu and self.quantize and self.cpu_dtype != 'fp32':
+            logger.warning("动态int8量化需要fp32权重，CPU精度已切换为fp32")
+            self.cpu_dtype = 'fp32'
+
+    @property
+    def is_cpu(self) -> bool:
+        return self.device == 'cpu'
+
+    @property
+    def dtype(self) -> torch.dtype:
+        """模型加载精度"""
+        if self.is_cpu:
+            return CPU_DTYPES[self.cpu_dtype]
+        return torch.float16
+
+    def setup(self):
+        """进程级设置，在加载模型前调用一次"""
+        if self.is_cpu and self.cpu_threads > 0:
+            torch.set_num_threads(self.cpu_threads)
+        logger.info(f"推理后端: {self.describe()}")
+
+    def prepare_pipeline(self, pipeline):
+        """将管线移动到目标设备并应用对应的优化"""
+        pipeline = pipeline.to(self.device)
+
+        if not self.is_cpu:
+            pipeline.enable_memory_efficient_attention()
+            return pipeline
+
+        if self.channels_last:
+            pipeline.unet.to(memory_format=torch.channels_last)
+            pipeline.vae.to(memory_format=torch.channels_last)
+            if getattr(pipeline, 'controlnet', None) is not None:
+                pipeline.controlnet.to(memory_format=torch.channels_last)
+
+        if self.quantize:
+            # 只量化Linear层，卷积保持fp32
+            pipeline.unet = torch.ao.quantization.quantize_dynamic(
+                pipeline.unet, {torch.nn.Linear}, dtype=torch.qint8
+            )
+            pipeline.text_encoder = torch.ao.quantization.quantize_dynamic(
+                pipeline.text_encoder, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
+        if self.torch_compile:
+            pipeline.unet = torch.compile(pipeline.unet)
+
+        return pipeline
+
+    def prepare_module(self, module):
+        """将单个模型(如ControlNet)移动到目标设备"""
+        module = module.to(self.device)
+        if self.is_cpu and self.channels_last:
+            module.to(memory_format=torch.channels_last)
+        return module
+
+    def autocast(self):
+        """推理时使用的autocast上下文"""
+        if not self.is_cpu:
+            return torch.autocast("cuda")
+        if self.dtype == torch.bfloat16:
+            return torch.autocast("cpu", dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
+    def describe(self) -> dict:
+        """返回当前后端配置，用于日志和健康检查"""
+        info = {"device": self.device, "dtype": str(self.dtype).replace('torch.', '')}
+        if self.is_cpu:
+            info.update({
+                "threads": torch.get_num_threads(),
+                "channels_last": self.channels_last,
+                "quantize": self.quantize,
+                "torch_compile": self.torch_compile,
+            })
+        return info
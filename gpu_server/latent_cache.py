@@ -0,0 +1,88 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import torch
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+class LatentCache:
+    """初始图像VAE编码结果缓存，按显存/内存占用做LRU淘汰
+
+    同一张照片尝试不同风格时只在第一次生成时运行VAE编码器。
+    缓存的是潜变量分布的均值(已乘scaling_factor)，diffusers的img2img和
+    ControlNet img2img管线在image为4通道张量时会直接把它当作初始潜变量使用。
+    """
+    def __init__(self, max_bytes: int = None):
+        if max_bytes is None:
+            max_bytes = int(os.getenv('SD_LATENT_CACHE_MB', '256')) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image: Image.Image, dtype: torch.dtype, model: str) -> str:
+        """根据图像内容、尺寸、精度和模型生成缓存键"""
+        digest = hashlib.sha256(image.tobytes()).hexdigest()
+        return f"{model}:{image.width}x{image.height}:{dtype}:{digest}"
+
+    def get_or_encode(self, pipeline, image: Image.Image) -> torch.Tensor:
+        """返回图像的初始潜变量，未命中时用管线的VAE编码"""
+        vae = pipeline.vae
+        key = self.make_key(image, vae.dtype, pipeline.name_or_path)
+
+        with self._lock:
+            latents = self._entries.get(key)
+            if latents is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return latents
+            self.misses += 1
+
+        latents = self._encode(pipeline, image)
+        self._put(key, latents)
+        return latents
+
+    @torch.no_grad()
+    def _encode(self, pipeline, image: Image.Image) -> torch.Tensor:
+        vae = pipeline.vae
+        tensor = pipeline.image_processor.preprocess(image)
+        tensor = tensor.to(device=vae.device, dtype=vae.dtype)
+        latents = vae.encode(tensor).latent_dist.mode()
+        return latents * vae.config.scaling_factor
+
+    def _put(self, key: str, latents: torch.Tensor):
+        size = latents.element_size() * latents.nelement()
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = latents
+            self._bytes += size
+            # 超出容量时淘汰最久未使用的条目
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.element_size() * evicted.nelement()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """缓存统计信息"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,187 @@
+import os
+import json
+import uuid
+import hashlib
+import select
+import struct
+import socket
+import logging
+import threading
+import socketserver
+from multiprocessing import shared_memory, resource_tracker
+from typing import Callable, Optional, Tuple
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 共享内存图像引用，格式 shm://<名称>/<宽>x<高>，内容为RGB uint8像素
+# 这是复制式传输：PIL内部按每像素4字节存储，写入时解包为RGB再复制到共享内存，
+# 读取时从共享内存复制一次，省去的是PNG编解码、base64和HTTP，而不是像素复制
+SHM_PREFIX = 'shm://'
+
+# 服务端创建的结果块名称前缀，后面再加上按套接字路径计算的实例标识
+OUTPUT_BLOCK_PREFIX = 'sd_out_'
+SHM_DIR = '/dev/shm'
+
+# 消息帧：4字节长度 + JSON
+_FRAME_HEADER = struct.Struct('!I')
+
+def send_message(sock: socket.socket, message: dict):
+    data = json.dumps(message).encode()
+    sock.sendall(_FRAME_HEADER.pack(len(data)) + data)
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(size - len(buffer))
+        if not chunk:
+            return None
+        buffer += chunk
+    return bytes(buffer)
+
+def recv_message(sock: socket.socket) -> Optional[dict]:
+    """读取一条消息，对方关闭连接时返回None"""
+    header = _recv_exact(sock, _FRAME_HEADER.size)
+    if header is None:
+        return None
+    data = _recv_exact(sock, _FRAME_HEADER.unpack(header)[0])
+    return json.loads(data) if data is not None else None
+
+def _untrack(shm: shared_memory.SharedMemory):
+    """共享内存由对方进程负责删除，避免本进程的resource_tracker在退出时删除或报告泄漏"""
+    resource_tracker.unregister(shm._name, 'shared_memory')
+
+def read_image(ref: str) -> Image.Image:
+    """从客户端创建的共享内存读取输入图像 (由客户端负责删除)"""
+    name, size = ref[len(SHM_PREFIX):].rsplit('/', 1)
+    width, height = (int(v) for v in size.split('x'))
+    shm = shared_memory.SharedMemory(name=name)
+    _untrack(shm)
+    try:
+        return Image.frombytes('RGB', (width, height), shm.buf)
+    finally:
+        shm.close()
+
+def discard_image(ref: str):
+    """删除未能交给客户端的结果块"""
+    name = ref[len(SHM_PREFIX):].rsplit('/', 1)[0]
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+def sweep_output_blocks(prefix: str):
+    """清理本实例上次运行遗留的结果块 (客户端在读取前退出时会留下)"""
+    if not os.path.isdir(SHM_DIR):
+        return
+    removed = 0
+    for name in os.listdir(SHM_DIR):
+        if name.startswith(prefix):
+            try:
+                os.unlink(os.path.join(SHM_DIR, name))
+                removed += 1
+            except OSError:
+                pass
+    if removed:
+        logger.info(f"已清理 {removed} 个遗留的共享内存结果块")
+
+def _watch_disconnect(sock: socket.socket, done: threading.Event, on_disconnect: Callable[[], None]):
+    """请求处理期间检测客户端是否已关闭连接"""
+    while not done.wait(0.5):
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            continue
+        try:
+            data = sock.recv(1, socket.MSG_PEEK)
+        except OSError:
+            data = b''
+        if not data:
+            on_disconnect()
+            return
+
+class LocalTransportServer:
+    """同机部署时的本机传输：Unix域套接字传递JSON请求，图像以原始像素放在共享内存中
+
+    省去PNG编码、base64和HTTP的开销。请求格式与HTTP接口相同，init_images和返回的images
+    换成共享内存引用。dispatch(endpoint, payload, traceparent) 返回 (状态码, 响应体)。
+    生成请求处理期间客户端断开连接时调用on_disconnect(job_id)，与HTTP接口一样中断任务。
+    """
+    def __init__(self, path: str, dispatch: Callable[[str, dict, Optional[str]], Tuple[int, dict]],
+                 on_disconnect: Callable[[str], None] = None):
+        self.path = path
+        self.dispatch = dispatch
+        self.on_disconnect = on_disconnect
+        # 同一IPC命名空间中可能有多个实例，结果块名称带上按套接字路径计算的标识，
+        # 重启后只清理使用同一套接字的上一个实例留下的块
+        instance = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+        self.block_prefix = f"{OUTPUT_BLOCK_PREFIX}{instance}_"
+        self._server: Optional[socketserver.ThreadingUnixStreamServer] = None
+
+    def start(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # 清理上次异常退出留下的套接字文件
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        sweep_output_blocks(self.block_prefix)
+
+        transport = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    message = recv_message(self.request)
+                    if message is None:
+                        return
+                    status, body = transport._handle(self.request, message)
+                    try:
+                        send_message(self.request, {"status": status, "body": body})
+                    except OSError as e:
+                        # 客户端已超时或断开，结果块没人读取，由服务端删除
+                        logger.warning(f"本机传输响应发送失败: {e}")
+                        for ref in body.get('images', []) if status == 200 else []:
+                            discard_image(ref)
+                        return
+
+        self._server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="local-transport", daemon=True).start()
+        logger.info(f"本机传输已启动: {self.path}")
+
+    def write_image(self, image: Image.Image) -> str:
+        """把结果图像写入新的共享内存，所有权交给客户端，客户端读取后删除"""
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        data = image.tobytes()
+        shm = shared_memory.SharedMemory(name=f"{self.block_prefix}{uuid.uuid4().hex}", create=True, size=len(data))
+        _untrack(shm)
+        shm.buf[:len(data)] = data
+        shm.close()
+        return f"{SHM_PREFIX}{shm.name}/{image.width}x{image.height}"
+
+    def _handle(self, sock: socket.socket, message: dict) -> Tuple[int, dict]:
+        payload = message['payload']
+        if self.on_disconnect is None or 'init_images' not in payload:
+            return self.dispatch(message['endpoint'], payload, message.get('traceparent'))
+
+        # 生成请求：监视连接，客户端断开时中断任务
+        job_id = payload.setdefault('job_id', uuid.uuid4().hex)
+        done = threading.Event()
+        watcher = threading.Thread(target=_watch_disconnect, name="local-transport-watch", daemon=True,
+                                   args=(sock, done, lambda: self.on_disconnect(job_id)))
+        watcher.start()
+        try:
+            return self.dispatch(message['endpoint'], payload, message.get('traceparent'))
+        finally:
+            done.set()
+            watcher.join()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
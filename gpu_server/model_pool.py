@@ -0,0 +1,181 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import torch
+from diffusers import StableDiffusionImg2ImgPipeline, StableDiffusionControlNetImg2ImgPipeline, ControlNetModel
+
+logger = logging.getLogger(__name__)
+
+# 模型所在层级
+TIER_DEVICE = 'device'   # 热：在推理设备上
+TIER_HOST = 'host'       # 温：停放在主机内存
+TIER_DISK = 'disk'       # 冷：需要从磁盘/缓存加载
+
+def _env_list(name: str, default: str = '') -> List[str]:
+    return [item.strip() for item in os.getenv(name, default).split(',') if item.strip()]
+
+def _module_bytes(*modules) -> int:
+    """估算模块参数占用的内存"""
+    return sum(
+        param.numel() * param.element_size()
+        for module in modules if module is not None
+        for param in module.parameters()
+    )
+
+class PoolEntry:
+    """模型池中的一个checkpoint"""
+    def __init__(self, model_id: str, pipeline):
+        self.model_id = model_id
+        self.pipeline = pipeline
+        self.controlnet_pipeline = None
+        self.tier = TIER_DEVICE
+        self.bytes = _module_bytes(pipeline.unet, pipeline.vae, pipeline.text_encoder)
+        self.last_used = time.time()
+
+class ModelPool:
+    """多checkpoint模型池，按设备/主机内存/磁盘三级分层，LRU淘汰
+
+    热模型留在推理设备上，超出设备预算时最久未使用的模型被移到主机内存，
+    主机内存也超出预算时直接释放，下次使用时重新从磁盘加载。
+    CPU后端下设备即主机内存，只有热/冷两级。
+    """
+    def __init__(self, backend,
+                 models: List[str] = None,
+                 default_model: str = None,
+                 controlnet_model: str = None,
+                 device_budget_mb: int = None,
+                 host_budget_mb: int = None):
+        self.backend = backend
+        self.default_model = default_model or os.getenv('SD_DEFAULT_MODEL', 'runwayml/stable-diffusion-v1-5')
+        self.models = models or _env_list('SD_MODELS') or [self.default_model]
+        if self.default_model not in self.models:
+            self.models.insert(0, self.default_model)
+        self.controlnet_model = controlnet_model or os.getenv('SD_CONTROLNET_MODEL', 'lllyasviel/sd-controlnet-openpose')
+
+        if device_budget_mb is None:
+            device_budget_mb = int(os.getenv('SD_DEVICE_MEMORY_MB', '0'))
+        if host_budget_mb is None:
+            host_budget_mb = int(os.getenv('SD_HOST_MEMORY_MB', '0'))
+        # 0表示只保留一个热模型
+        self.device_budget = device_budget_mb * 1024 * 1024
+        self.host_budget = host_budget_mb * 1024 * 1024
+
+        self._entries: "OrderedDict[str, PoolEntry]" = OrderedDict()
+        self._controlnet = None
+        self._lock = threading.RLock()
+
+    def resolve(self, model_id: Optional[str]) -> str:
+        """解析请求中的模型名，未指定时使用默认模型"""
+        model_id = model_id or self.default_model
+        if model_id not in self.models:
+            raise KeyError(f"未知模型: {model_id}，可用: {self.models}")
+        return model_id
+
+    def get(self, model_id: Optional[str] = None):
+        """获取img2img管线，必要时从主机内存或磁盘加载到设备"""
+        with self._lock:
+            return self._acquire(self.resolve(model_id)).pipeline
+
+    def get_controlnet(self, model_id: Optional[str] = None):
+        """获取ControlNet img2img管线，与同一checkpoint的img2img管线共享组件"""
+        with self._lock:
+            entry = self._acquire(self.resolve(model_id))
+            if entry.controlnet_pipeline is None:
+                entry.controlnet_pipeline = StableDiffusionControlNetImg2ImgPipeline(
+                    **entry.pipeline.components,
+                    controlnet=self._load_controlnet(),
+                    requires_safety_checker=False
+                )
+                # 直接构造的管线没有_name_or_path，潜变量缓存按它区分checkpoint
+                entry.controlnet_pipeline.register_to_config(_name_or_path=entry.model_id)
+                entry.controlnet_pipeline.set_progress_bar_config(disable=True)
+            return entry.controlnet_pipeline
+
+    def preload(self, model_ids: List[str]):
+        """预加载提示：按顺序加载模型，超出预算的会自然降级到主机内存"""
+        with self._lock:
+            for model_id in model_ids:
+                self._acquire(self.resolve(model_id))
+
+    def _acquire(self, model_id: str) -> PoolEntry:
+        entry = self._entries.get(model_id)
+        if entry is None:
+            entry = PoolEntry(model_id, self._load_from_disk(model_id))
+            self._entries[model_id] = entry
+        elif entry.tier == TIER_HOST:
+            started = time.perf_counter()
+            entry.pipeline.to(self.backend.device)
+            entry.tier = TIER_DEVICE
+            logger.info(f"模型 {model_id} 从主机内存恢复到设备，用时 {time.perf_counter() - started:.2f}s")
+
+        entry.last_used = time.time()
+        self._entries.move_to_end(model_id)
+        self._evict(keep=model_id)
+        return entry
+
+    def _load_from_disk(self, model_id: str):
+        started = time.perf_counter()
+        logger.info(f"正在加载模型 {model_id}...")
+        pipeline = StableDiffusionImg2ImgPipeline.from_pretrained(
+            model_id,
+            torch_dtype=self.backend.dtype,
+            safety_checker=None,
+            requires_safety_checker=False
+        )
+        pipeline.set_progress_bar_config(disable=True)
+        pipeline = self.backend.prepare_pipeline(pipeline)
+        logger.info(f"模型 {model_id} 加载完成，用时 {time.perf_counter() - started:.2f}s")
+        return pipeline
+
+    def _load_controlnet(self):
+        if self._controlnet is None:
+            logger.info(f"正在加载ControlNet模型 {self.controlnet_model}...")
+            controlnet = ControlNetModel.from_pretrained(self.controlnet_model, torch_dtype=self.backend.dtype)
+            self._controlnet = self.backend.prepare_module(controlnet)
+        return self._controlnet
+
+    def _tier_bytes(self, tier: str) -> int:
+        return sum(entry.bytes for entry in self._entries.values() if entry.tier == tier)
+
+    def _evict(self, keep: str):
+        """按LRU顺序降级超出预算的模型，keep为当前请求的模型，不会被淘汰"""
+        for model_id, entry in list(self._entries.items()):
+            if model_id == keep or entry.tier != TIER_DEVICE:
+                continue
+            if self._tier_bytes(TIER_DEVICE) <= self.device_budget:
+                break
+            if self.backend.is_cpu:
+                self._drop(model_id)
+            else:
+                entry.pipeline.to('cpu')
+                entry.tier = TIER_HOST
+                logger.info(f"模型 {model_id} 降级到主机内存")
+
+        for model_id, entry in list(self._entries.items()):
+            if entry.tier != TIER_HOST:
+                continue
+            if self._tier_bytes(TIER_HOST) <= self.host_budget:
+                break
+            self._drop(model_id)
+
+        if not self.backend.is_cpu:
+            torch.cuda.empty_cache()
+
+    def _drop(self, model_id: str):
+        self._entries.pop(model_id)
+        logger.info(f"模型 {model_id} 已从内存中释放")
+
+    def stats(self) -> Dict[str, dict]:
+        """各模型所在层级及占用"""
+        with self._lock:
+            result = {model_id: {"tier": TIER_DISK} for model_id in self.models}
+            for model_id, entry in self._entries.items():
+                result[model_id] = {
+                    "tier": entry.tier,
+                    "bytes": entry.bytes,
+                    "last_used": entry.last_used,
+                }
+            return result
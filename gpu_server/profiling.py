@@ -0,0 +1,198 @@
+import os
+import io
+import time
+import uuid
+import json
+import pstats
+import cProfile
+import zipfile
+import logging
+import threading
+import contextlib
+from collections import defaultdict
+from typing import Optional
+import torch
+
+logger = logging.getLogger(__name__)
+
+# 未开启分析时复用的空上下文，保证关闭状态下没有额外开销
+_NULL_CONTEXT = contextlib.nullcontext()
+
+class ProfileSession:
+    """一次分析会话，覆盖接下来的N个请求或T秒"""
+    def __init__(self, output_dir: str, max_requests: Optional[int], seconds: Optional[float], torch_ops: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.output_dir = os.path.join(output_dir, self.id)
+        self.max_requests = max_requests
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.torch_ops = torch_ops
+        self.started_at = time.time()
+        self.requests = 0
+        # 正在进行中的请求数，会话结束后等它们全部完成再写出结果
+        self.running = 0
+        self.phases = defaultdict(list)
+        self.cprofile = cProfile.Profile()
+        self.finished = False
+
+        self.torch_activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            self.torch_activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+    @property
+    def expired(self) -> bool:
+        if self.max_requests is not None and self.requests >= self.max_requests:
+            return True
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def summary(self) -> dict:
+        """按阶段汇总耗时(毫秒)"""
+        phases = {}
+        for name, durations in self.phases.items():
+            phases[name] = {
+                "count": len(durations),
+                "total_ms": sum(durations) * 1000,
+                "mean_ms": sum(durations) / len(durations) * 1000,
+                "max_ms": max(durations) * 1000,
+            }
+        return {
+            "id": self.id,
+            "started_at": self.started_at,
+            "requests": self.requests,
+            "finished": self.finished,
+            "phases": phases,
+        }
+
+class RequestProfiler:
+    """按需开启的请求分析器：cProfile记录Python侧，torch.profiler记录算子"""
+    def __init__(self, output_dir: str = None):
+        self.output_dir = output_dir or os.getenv('SD_PROFILE_DIR', './profiles')
+        self.session: Optional[ProfileSession] = None
+        self.sessions = {}
+        self._lock = threading.Lock()
+        # 当前线程正在分析的请求所属会话，会话结束后进行中的请求仍记录到原会话
+        self._local = threading.local()
+
+    def _request_session(self) -> Optional[ProfileSession]:
+        return getattr(self._local, 'session', None)
+
+    @property
+    def active(self) -> bool:
+        return self.session is not None or self._request_session() is not None
+
+    def start(self, max_requests: Optional[int] = None, seconds: Optional[float] = None,
+              torch_ops: bool = True) -> ProfileSession:
+        """开始新的分析会话"""
+        with self._lock:
+            if self.session is not None:
+                raise RuntimeError(f"已有进行中的分析会话: {self.session.id}")
+            session = ProfileSession(self.output_dir, max_requests, seconds, torch_ops)
+            self.sessions[session.id] = session
+            self.session = session
+        logger.info(f"开始性能分析 {session.id}: requests={max_requests}, seconds={seconds}")
+        return session
+
+    def stop(self) -> Optional[ProfileSession]:
+        """结束当前会话，不再接受新请求
+
+        仍有请求在分析中时由最后一个完成的请求写出结果，避免cProfile数据在请求中途被截断，
+        以及算子trace在结果打包之后才写出。
+        """
+        with self._lock:
+            session, self.session = self.session, None
+            if session is None:
+                return None
+            write_now = session.running == 0
+        if write_now:
+            self._write(session)
+        return session
+
+    def check_expired(self):
+        """会话达到请求数或时间上限时自动结束"""
+        session = self.session
+        if session is not None and session.expired:
+            self.stop()
+
+    @contextlib.contextmanager
+    def _profile_request(self, session: ProfileSession):
+        # 每个请求单独导出一份算子trace，可直接在chrome://tracing或Perfetto中打开
+        torch_profiler = None
+        if session.torch_ops:
+            torch_profiler = torch.profiler.profile(activities=session.torch_activities, record_shapes=True)
+            torch_profiler.start()
+        self._local.session = session
+        session.cprofile.enable()
+        try:
+            yield
+        finally:
+            session.cprofile.disable()
+            self._local.session = None
+            if torch_profiler is not None:
+                torch_profiler.stop()
+                torch_profiler.export_chrome_trace(
+                    self._ensure_dir(session, f"torch_trace_{session.requests}.json"))
+            with self._lock:
+                session.requests += 1
+                session.running -= 1
+                # 会话已在请求进行期间结束，最后一个完成的请求负责写出结果
+                write_now = self.session is not session and session.running == 0
+            if write_now:
+                self._write(session)
+        self.check_expired()
+
+    def request(self):
+        """包裹一次完整请求"""
+        self.check_expired()
+        with self._lock:
+            session = self.session
+            if session is None:
+                return _NULL_CONTEXT
+            session.running += 1
+        return self._profile_request(session)
+
+    @contextlib.contextmanager
+    def _time_phase(self, session: ProfileSession, name: str):
+        start = time.perf_counter()
+        try:
+            with torch.profiler.record_function(name):
+                yield
+        finally:
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            session.phases[name].append(time.perf_counter() - start)
+
+    def phase(self, name: str):
+        """记录一个处理阶段的耗时"""
+        session = self._request_session()
+        if session is None:
+            return _NULL_CONTEXT
+        return self._time_phase(session, name)
+
+    def _ensure_dir(self, session: ProfileSession, filename: str) -> str:
+        os.makedirs(session.output_dir, exist_ok=True)
+        return os.path.join(session.output_dir, filename)
+
+    def _write(self, session: ProfileSession):
+        session.cprofile.create_stats()
+        session.cprofile.dump_stats(self._ensure_dir(session, "python.prof"))
+
+        text = io.StringIO()
+        pstats.Stats(session.cprofile, stream=text).sort_stats('cumulative').print_stats(50)
+        with open(self._ensure_dir(session, "python_top.txt"), 'w') as f:
+            f.write(text.getvalue())
+
+        with open(self._ensure_dir(session, "phases.json"), 'w') as f:
+            json.dump({**session.summary(), "finished": True}, f, indent=2, ensure_ascii=False)
+        # 所有文件写完后才允许打包下载
+        session.finished = True
+        logger.info(f"性能分析 {session.id} 完成，共 {session.requests} 个请求")
+
+    def archive(self, session_id: str) -> Optional[str]:
+        """将会话结果打包为zip，返回文件路径"""
+        session = self.sessions.get(session_id)
+        if session is None or not session.finished:
+            return None
+        archive_path = os.path.join(self.output_dir, f"{session_id}.zip")
+        with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for filename in os.listdir(session.output_dir):
+                zf.write(os.path.join(session.output_dir, filename), arcname=filename)
+        return archive_path
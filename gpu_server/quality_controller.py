@@ -0,0 +1,212 @@
+import os
+import math
+import threading
+import contextlib
+import logging
+from collections import deque
+from typing import List, Optional
+from diffusers import (
+    DDIMScheduler,
+    DPMSolverMultistepScheduler,
+    EulerAncestralDiscreteScheduler,
+    EulerDiscreteScheduler,
+)
+
+logger = logging.getLogger(__name__)
+
+# 降级阶梯，越往下越便宜：先换用收敛更快的调度器并减少步数，最后降低分辨率
+QUALITY_LEVELS = [
+    {"steps": 1.0, "resolution": 1.0, "scheduler": None},
+    {"steps": 0.7, "resolution": 1.0, "scheduler": "DPM++ 2M Karras"},
+    {"steps": 0.5, "resolution": 1.0, "scheduler": "DPM++ 2M Karras"},
+    {"steps": 0.5, "resolution": 0.75, "scheduler": "DPM++ 2M Karras"},
+    {"steps": 0.35, "resolution": 0.75, "scheduler": "DPM++ 2M Karras"},
+]
+
+# 降级后的最少步数
+MIN_STEPS = 8
+
+# 调度器名称 (兼容Automatic1111的sampler名称) -> (调度器类, 参数)
+SCHEDULERS = {
+    "DPM++ 2M Karras": (DPMSolverMultistepScheduler, {"use_karras_sigmas": True}),
+    "DPM++ 2M": (DPMSolverMultistepScheduler, {}),
+    "Euler a": (EulerAncestralDiscreteScheduler, {}),
+    "Euler": (EulerDiscreteScheduler, {}),
+    "DDIM": (DDIMScheduler, {}),
+}
+
+@contextlib.contextmanager
+def use_scheduler(pipelines: List, name: Optional[str]):
+    """在一次生成期间临时替换管线的调度器 (管线在多个请求之间共享)"""
+    if name is None:
+        yield
+        return
+    scheduler_class, kwargs = SCHEDULERS[name]
+    originals = [pipeline.scheduler for pipeline in pipelines]
+    scheduler = scheduler_class.from_config(originals[0].config, **kwargs)
+    try:
+        for pipeline in pipelines:
+            pipeline.scheduler = scheduler
+        yield
+    finally:
+        for pipeline, original in zip(pipelines, originals):
+            pipeline.scheduler = original
+
+def _round8(value: float) -> int:
+    return max(256, int(round(value / 8)) * 8)
+
+class QualityController:
+    """按负载自适应调整生成质量，使延迟保持在p95目标以内
+
+    用EWMA跟踪每单位工作量 (去噪步数 x 百万像素 x 图像数) 的耗时，
+    每个请求开始时根据排队深度和已等待时间预测延迟：超过目标时沿QUALITY_LEVELS逐级降级，
+    预测延迟低于目标的restore_margin倍时逐级恢复。未设置SD_LATENCY_TARGET时只统计不降级。
+    """
+    def __init__(self,
+                 latency_target: float = None,
+                 restore_margin: float = None,
+                 ewma_alpha: float = 0.3,
+                 window: int = 200):
+        if latency_target is None and os.getenv('SD_LATENCY_TARGET'):
+            latency_target = float(os.getenv('SD_LATENCY_TARGET'))
+        self.latency_target = latency_target
+        self.restore_margin = restore_margin or float(os.getenv('SD_LATENCY_RESTORE_MARGIN', '0.7'))
+        self.ewma_alpha = ewma_alpha
+        self.level = 0
+        # 每单位工作量的耗时 (秒)，收到第一个请求的测量值之前为None
+        self.unit_seconds: Optional[float] = None
+        self._latencies: deque = deque(maxlen=window)
+        self._decisions = [0] * len(QUALITY_LEVELS)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.latency_target is not None
+
+    @staticmethod
+    def work_units(steps: int, strength: float, width: int, height: int, batch: int) -> float:
+        """工作量 = 实际去噪步数 x 百万像素 x 图像数，img2img实际运行 steps * strength 步"""
+        return max(1, int(steps * strength)) * width * height / 1e6 * batch
+
+    def request_work(self, request, hires=None) -> float:
+        """请求的总工作量，包括两阶段生成的细化pass"""
+        batch = len(request.init_images)
+        work = self.work_units(request.steps, request.denoising_strength, request.width, request.height, batch)
+        if hires is not None and hires.steps > 0:
+            work += hires.steps * hires.width * hires.height / 1e6 * batch
+        return work
+
+    def _settings(self, request, level: int) -> dict:
+        config = QUALITY_LEVELS[level]
+        if level == 0:
+            return {"steps": request.steps, "width": request.width, "height": request.height, "scheduler": None}
+        return {
+            "steps": max(min(MIN_STEPS, request.steps), round(request.steps * config["steps"])),
+            "width": _round8(request.width * config["resolution"]),
+            "height": _round8(request.height * config["resolution"]),
+            "scheduler": config["scheduler"],
+        }
+
+    def _predict(self, request, level: int, queued: int, waited: float) -> float:
+        """预测延迟：取本请求(已等待+自身耗时)与队尾请求(排在前面的请求都按同一档位处理)中较大的"""
+        settings = self._settings(request, level)
+        cost = self.unit_seconds * self.work_units(settings["steps"], request.denoising_strength,
+                                                   settings["width"], settings["height"], len(request.init_images))
+        return max(waited + cost, (queued + 1) * cost)
+
+    def decide(self, request, queued: int, waited: float, adaptive: bool = True) -> dict:
+        """请求获得生成锁时调用，返回本次使用的质量档位和参数"""
+        with self._lock:
+            level = 0
+            if self.enabled and adaptive and self.unit_seconds is not None:
+                level = self.level
+                while level < len(QUALITY_LEVELS) - 1 and \
+                        self._predict(request, level, queued, waited) > self.latency_target:
+                    level += 1
+                if level == self.level and level > 0 and \
+                        self._predict(request, level - 1, queued, waited) < self.latency_target * self.restore_margin:
+                    level -= 1
+                if level != self.level:
+                    logger.info(f"质量档位 {self.level} -> {level} (排队 {queued}，已等待 {waited:.1f}s)")
+                    self.level = level
+
+            predicted = self._predict(request, level, queued, waited) if self.unit_seconds is not None else None
+            self._decisions[level] += 1
+
+        return {
+            "level": level,
+            **self._settings(request, level),
+            "queue_depth": queued,
+            "waited": round(waited, 3),
+            "predicted_latency": round(predicted, 3) if predicted is not None else None,
+            "latency_target": self.latency_target,
+        }
+
+    @staticmethod
+    def apply(request, decision: dict):
+        """返回按决策调整了步数和分辨率的请求副本"""
+        if decision["level"] == 0:
+            return request
+        return request.copy(update={key: decision[key] for key in ("steps", "width", "height")})
+
+    def observe(self, work: float, seconds: float, latency: float):
+        """记录一次生成的耗时和端到端延迟"""
+        with self._lock:
+            if work > 0:
+                sample = seconds / work
+                if self.unit_seconds is None:
+                    self.unit_seconds = sample
+                else:
+                    self.unit_seconds += self.ewma_alpha * (sample - self.unit_seconds)
+            self._latencies.append(latency)
+
+    def p95(self) -> Optional[float]:
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[max(0, math.ceil(len(ordered) * 0.95) - 1)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "level": self.level,
+                "latency_target": self.latency_target,
+                "latency_p95": self.p95(),
+                "unit_seconds": self.unit_seconds,
+                "decisions": {str(level): count for level, count in enumerate(self._decisions)},
+            }
+
+    def metrics(self, queued: int) -> str:
+        """Prometheus文本格式的指标"""
+        stats = self.stats()
+        lines = [
+            "# HELP sd_queue_depth Requests waiting for the generation lock",
+            "# TYPE sd_queue_depth gauge",
+            f"sd_queue_depth {queued}",
+            "# HELP sd_quality_level Current quality level (0 = full quality)",
+            "# TYPE sd_quality_level gauge",
+            f"sd_quality_level {stats['level']}",
+            "# HELP sd_quality_decisions_total Requests served at each quality level",
+            "# TYPE sd_quality_decisions_total counter",
+        ]
+        lines += [f'sd_quality_decisions_total{{level="{level}"}} {count}' for level, count in stats["decisions"].items()]
+        if stats["latency_target"] is not None:
+            lines += [
+                "# HELP sd_latency_target_seconds Configured p95 latency target",
+                "# TYPE sd_latency_target_seconds gauge",
+                f"sd_latency_target_seconds {stats['latency_target']}",
+            ]
+        if stats["latency_p95"] is not None:
+            lines += [
+                "# HELP sd_latency_p95_seconds Observed p95 latency over recent requests",
+                "# TYPE sd_latency_p95_seconds gauge",
+                f"sd_latency_p95_seconds {stats['latency_p95']}",
+            ]
+        if stats["unit_seconds"] is not None:
+            lines += [
+                "# HELP sd_step_seconds_per_megapixel EWMA of seconds per denoising step per megapixel",
+                "# TYPE sd_step_seconds_per_megapixel gauge",
+                f"sd_step_seconds_per_megapixel {stats['unit_seconds']}",
+            ]
+        return '\n'.join(lines) + '\n'
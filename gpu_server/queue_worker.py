@@ -0,0 +1,129 @@
+import os
+import json
+import socket
+import logging
+import threading
+import urllib.request
+import urllib.error
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class QueueWorker:
+    """从Bot的持久化任务队列拉取生成任务的worker
+
+    领取任务后在后台线程中定期心跳延长租约，处理完成后提交结果；
+    处理失败时报告错误，由队列决定是否重试。启动更多GPU服务即可扩容。
+    """
+    def __init__(self, queue_url: str,
+                 handlers: Dict[str, Callable[[dict], dict]],
+                 worker_id: str = None,
+                 lease_seconds: float = None,
+                 poll_interval: float = None,
+                 on_lease_lost: Callable[[str], None] = None):
+        self.queue_url = queue_url.rstrip('/')
+        self.handlers = handlers
+        self.worker_id = worker_id or os.getenv('SD_WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds or float(os.getenv('SD_QUEUE_LEASE_SECONDS', '30'))
+        self.poll_interval = poll_interval or float(os.getenv('SD_QUEUE_POLL_INTERVAL', '1.0'))
+        self.token = os.getenv('SD_QUEUE_TOKEN')
+        self.on_lease_lost = on_lease_lost
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="queue-worker", daemon=True)
+        self._thread.start()
+        logger.info(f"队列worker {self.worker_id} 已启动，队列地址: {self.queue_url}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _post(self, path: str, body: dict) -> Optional[dict]:
+        """向队列接口发送请求，204返回None"""
+        request = urllib.request.Request(
+            f"{self.queue_url}{path}",
+            data=json.dumps(body).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        if self.token:
+            request.add_header("X-Queue-Token", self.token)
+        with urllib.request.urlopen(request, timeout=30) as response:
+            if response.status == 204:
+                return None
+            return json.loads(response.read())
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                try:
+                    job = self._post("/jobs/lease", {"worker_id": self.worker_id, "lease_seconds": self.lease_seconds})
+                except (urllib.error.URLError, OSError) as e:
+                    logger.warning(f"领取任务失败: {e}")
+                    job = None
+
+                if job is None:
+                    self._stop.wait(self.poll_interval)
+                    continue
+
+                self._process(job)
+            except Exception as e:
+                # 响应格式错误、上报失败等意外异常不能结束worker线程
+                logger.error(f"任务循环出错: {e!r}")
+                self._stop.wait(self.poll_interval)
+
+    def _process(self, job: dict):
+        job_id = job['id']
+        handler = self.handlers.get(job['kind'])
+        if handler is None:
+            self._report_failure(job_id, f"不支持的任务类型: {job['kind']}")
+            return
+
+        logger.info(f"开始处理任务 {job_id} ({job['kind']}, 第{job['attempt']}次尝试)")
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, done), daemon=True)
+        heartbeat.start()
+
+        try:
+            result = handler({**job['payload'], 'job_id': job_id})
+        except Exception as e:
+            logger.error(f"任务 {job_id} 处理失败: {e}")
+            self._report_failure(job_id, str(e) or repr(e))
+            return
+        finally:
+            done.set()
+            heartbeat.join()
+
+        try:
+            self._post(f"/jobs/{job_id}/result", {"worker_id": self.worker_id, "result": result})
+            logger.info(f"任务 {job_id} 完成")
+        except urllib.error.HTTPError as e:
+            # 409表示租约已被其他worker接管，结果作废
+            logger.warning(f"提交任务 {job_id} 结果失败: {e.code}")
+        except (urllib.error.URLError, OSError) as e:
+            logger.error(f"提交任务 {job_id} 结果失败: {e}")
+
+    def _heartbeat(self, job_id: str, done: threading.Event):
+        """在租约的三分之一周期内续约"""
+        while not done.wait(self.lease_seconds / 3):
+            try:
+                self._post(f"/jobs/{job_id}/heartbeat", {"worker_id": self.worker_id, "lease_seconds": self.lease_seconds})
+            except urllib.error.HTTPError as e:
+                # 409表示任务已被取消或租约被其他worker接管，停止继续计算
+                if e.code == 409:
+                    logger.info(f"任务 {job_id} 租约已失效，中断处理")
+                    if self.on_lease_lost is not None:
+                        self.on_lease_lost(job_id)
+                    return
+                logger.warning(f"任务 {job_id} 心跳失败: {e}")
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                logger.warning(f"任务 {job_id} 心跳失败: {e}")
+
+    def _report_failure(self, job_id: str, error: str):
+        try:
+            self._post(f"/jobs/{job_id}/fail", {"worker_id": self.worker_id, "error": error})
+        except (urllib.error.URLError, OSError) as e:
+            logger.error(f"报告任务 {job_id} 失败状态时出错: {e}")
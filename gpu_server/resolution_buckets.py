@@ -0,0 +1,41 @@
+import os
+from typing import List, Tuple
+from PIL import Image
+
+# 面积约为512x768的SD1.5分辨率桶，宽高均为64的倍数
+DEFAULT_BUCKETS = [
+    (384, 1024), (448, 832), (512, 768), (576, 640),
+    (640, 576), (768, 512), (832, 448), (1024, 384),
+    (512, 512),
+]
+
+def load_buckets() -> List[Tuple[int, int]]:
+    """读取分辨率桶，支持通过SD_RESOLUTION_BUCKETS覆盖，格式如 512x768,768x512"""
+    value = os.getenv('SD_RESOLUTION_BUCKETS')
+    if not value:
+        return list(DEFAULT_BUCKETS)
+
+    buckets = []
+    for item in value.split(','):
+        width, height = item.lower().strip().split('x')
+        buckets.append((int(width), int(height)))
+    return buckets
+
+def fit_to_size(image: Image.Image, width: int, height: int, fill=(255, 255, 255)) -> Image.Image:
+    """保持宽高比缩放到目标尺寸内，不足部分居中填充
+
+    分辨率桶由客户端选择 (Bot见utils/image_processing.py的closest_bucket)，这里只处理
+    尺寸与请求不一致的输入。缩放和填充方式与ImageProcessor.fit_to_bucket保持一致。
+    """
+    if image.size == (width, height):
+        return image
+
+    scale = min(width / image.width, height / image.height)
+    new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    resized = image.resize(new_size, Image.Resampling.LANCZOS)
+    if new_size == (width, height):
+        return resized
+
+    canvas = Image.new('RGB', (width, height), fill)
+    canvas.paste(resized, ((width - new_size[0]) // 2, (height - new_size[1]) // 2))
+    return canvas
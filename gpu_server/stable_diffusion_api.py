@@ -1,16 +1,33 @@
+import os
+import time
+import secrets
 import torch
-import io
-import base64
+import asyncio
+import threading
+import contextlib
 from PIL import Image
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import uvicorn
 import logging
-from diffusers import StableDiffusionImg2ImgPipeline, StableDiffusionControlNetImg2ImgPipeline
 from controlnet_aux import OpenposeDetector
-from diffusers import ControlNetModel
 import numpy as np
+from inference_backend import InferenceBackend
+from resolution_buckets import load_buckets, fit_to_size
+from image_codec import base64_to_image, image_to_base64
+from latent_cache import LatentCache
+from profiling import RequestProfiler
+from model_pool import ModelPool
+from queue_worker import QueueWorker
+from tracing import create_tracer, span
+from cancellation import CancellationRegistry, CancelToken, GenerationCancelled
+from acceleration import Accelerator
+from hires import HiresPlan, plan_hires, upscale_latents, upscale_images
+from quality_controller import QualityController, use_scheduler
+from local_transport import LocalTransportServer, read_image
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -19,9 +36,22 @@ logger = logging.getLogger(__name__)
 app = FastAPI(title="AI换装GPU服务", version="1.0.0")
 
 # 全局变量存储模型
-pipe = None
-controlnet_pipe = None
+model_pool = None
 openpose = None
+backend = InferenceBackend()
+resolution_buckets = load_buckets()
+latent_cache = LatentCache()
+profiler = RequestProfiler()
+tracer = create_tracer('gpu-server', os.getenv('SD_TRACE_EXPORTER'),
+                       os.getenv('SD_TRACE_FILE', './traces.jsonl'), os.getenv('SD_OTLP_ENDPOINT'))
+queue_worker = None
+local_transport = None
+cancellations = CancellationRegistry()
+accelerator = Accelerator()
+quality_controller = QualityController()
+
+# 同一时间只运行一个生成任务 (HTTP请求和队列worker共享)
+generation_lock = threading.Lock()
 
 class Img2ImgRequest(BaseModel):
     init_images: List[str]
@@ -33,6 +63,24 @@ class Img2ImgRequest(BaseModel):
     height: int = 768
     denoising_strength: float = 0.7
     sampler_name: str = "DPM++ 2M Karras"
+    model: Optional[str] = None
+    # 客户端生成的任务ID，用于中断；timeout为客户端等待的秒数，超时后任务被丢弃
+    job_id: Optional[str] = None
+    timeout: Optional[float] = None
+    # 加速模式 (none/tome/deepcache/tome+deepcache) 或质量档位 (high/balanced/fast)
+    acceleration: Optional[str] = None
+    quality: Optional[str] = None
+    # 两阶段高分辨率输出 (兼容Automatic1111的hires fix参数)：基础分辨率生成后放大，
+    # hr_second_pass_steps > 0 时在输出分辨率上细化
+    enable_hr: bool = False
+    hr_scale: float = 2.0
+    hr_resize_x: int = 0
+    hr_resize_y: int = 0
+    hr_upscaler: str = "Latent"
+    hr_second_pass_steps: int = 0
+    hr_denoising_strength: float = 0.35
+    # 是否允许负载过高时自动降低步数和分辨率
+    adaptive: bool = True
 
 class ControlNetRequest(BaseModel):
     init_images: List[str]
@@ -44,6 +92,35 @@ class ControlNetRequest(BaseModel):
     height: int = 768
     denoising_strength: float = 0.6
     controlnet_args: List[dict]
+    model: Optional[str] = None
+    # 客户端生成的任务ID，用于中断；timeout为客户端等待的秒数，超时后任务被丢弃
+    job_id: Optional[str] = None
+    timeout: Optional[float] = None
+    # 加速模式 (none/tome/deepcache/tome+deepcache) 或质量档位 (high/balanced/fast)
+    acceleration: Optional[str] = None
+    quality: Optional[str] = None
+    # 两阶段高分辨率输出 (兼容Automatic1111的hires fix参数)：基础分辨率生成后放大，
+    # hr_second_pass_steps > 0 时在输出分辨率上细化
+    enable_hr: bool = False
+    hr_scale: float = 2.0
+    hr_resize_x: int = 0
+    hr_resize_y: int = 0
+    hr_upscaler: str = "Latent"
+    hr_second_pass_steps: int = 0
+    hr_denoising_strength: float = 0.35
+    # 是否允许负载过高时自动降低步数和分辨率
+    adaptive: bool = True
+
+class InterruptRequest(BaseModel):
+    job_id: Optional[str] = None
+
+class PreloadRequest(BaseModel):
+    models: List[str]
+
+class ProfileRequest(BaseModel):
+    requests: Optional[int] = None
+    seconds: Optional[float] = None
+    torch_ops: bool = True
 
 class ProgressResponse(BaseModel):
     progress: float
@@ -51,39 +128,17 @@ class ProgressResponse(BaseModel):
 
 def load_models():
     """加载AI模型"""
-    global pipe, controlnet_pipe, openpose
+    global model_pool, openpose
     
     try:
-        logger.info("正在加载Stable Diffusion模型...")
-        
-        # 基础Stable Diffusion模型
-        pipe = StableDiffusionImg2ImgPipeline.from_pretrained(
-            "runwayml/stable-diffusion-v1-5",
-            torch_dtype=torch.float16,
-            safety_checker=None,
-            requires_safety_checker=False
-        )
-        pipe = pipe.to("cuda")
-        pipe.enable_memory_efficient_attention()
-        
-        logger.info("Stable Diffusion模型加载完成")
+        backend.setup()
+        model_pool = ModelPool(backend)
         
-        # ControlNet模型
-        logger.info("正在加载ControlNet模型...")
-        controlnet = ControlNetModel.from_pretrained(
-            "lllyasviel/sd-controlnet-openpose",
-            torch_dtype=torch.float16
-        )
-        
-        controlnet_pipe = StableDiffusionControlNetImg2ImgPipeline.from_pretrained(
-            "runwayml/stable-diffusion-v1-5",
-            controlnet=controlnet,
-            torch_dtype=torch.float16,
-            safety_checker=None,
-            requires_safety_checker=False
-        )
-        controlnet_pipe = controlnet_pipe.to("cuda")
-        controlnet_pipe.enable_memory_efficient_attention()
+        # 默认模型和预加载提示中的模型
+        logger.info("正在加载Stable Diffusion模型...")
+        preload = [m.strip() for m in os.getenv('SD_PRELOAD_MODELS', '').split(',') if m.strip()]
+        model_pool.preload(preload + [model_pool.default_model])
+        model_pool.get_controlnet()
         
         # OpenPose检测器
         openpose = OpenposeDetector.from_pretrained('lllyasviel/Annotators')
@@ -94,26 +149,184 @@ def load_models():
         logger.error(f"模型加载失败: {e}")
         raise
 
-def base64_to_image(base64_str: str) -> Image.Image:
-    """将base64转换为PIL图像"""
-    img_data = base64.b64decode(base64_str)
-    image = Image.open(io.BytesIO(img_data))
-    return image.convert('RGB')
+def decode_image(value: str, local: bool = False) -> Image.Image:
+    """解码请求中的图像：HTTP和队列为base64，本机传输为共享内存引用"""
+    return read_image(value) if local else base64_to_image(value)
+
+def validate_request(request) -> str:
+    """排队前校验参数，返回请求使用的加速模式，无效参数返回400
+
+    所有入口 (HTTP接口、队列worker、本机传输) 在登记取消标记之前调用：
+    标记只在generation_slot中释放，登记之后再拒绝请求会留下永远排队的标记。
+    """
+    if not request.init_images:
+        raise HTTPException(status_code=400, detail="需要提供初始图像")
+    try:
+        acceleration = accelerator.resolve(request.acceleration, request.quality)
+        # hires计划在确定质量档位后才计算 (adapt_quality)，这里只校验参数
+        plan_hires(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return acceleration
+
+def adapt_quality(request, cancel_token: CancelToken):
+    """获得生成锁后按当前负载决定质量档位，返回(调整后的请求, 两阶段生成计划, 决策)"""
+    decision = quality_controller.decide(request, cancellations.stats()["queued"], cancel_token.age,
+                                         adaptive=request.adaptive)
+    request = quality_controller.apply(request, decision)
+    # 参数已在validate_request中校验，降级只会缩小基础分辨率
+    return request, plan_hires(request), decision
+
+def get_pipeline(model: Optional[str], controlnet: bool = False):
+    """从模型池获取管线，未知模型返回400"""
+    try:
+        if controlnet:
+            return model_pool.get_controlnet(model)
+        return model_pool.get(model)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@contextlib.contextmanager
+def _profiled_phase(name: str):
+    with span(name), profiler.phase(name):
+        yield
+
+def phase(name: str):
+    """记录一个处理阶段：同时写入性能分析会话和请求追踪，两者都关闭时为空上下文"""
+    if not profiler.active:
+        return span(name)
+    return _profiled_phase(name)
+
+@contextlib.contextmanager
+def generation_slot(token: CancelToken):
+    """获取生成锁，等待时间记为queue_wait；排队期间被取消或超时的任务直接丢弃"""
+    try:
+        with span("queue_wait"):
+            while not generation_lock.acquire(timeout=0.5):
+                token.check()
+        try:
+            cancellations.start(token)
+            yield
+        finally:
+            generation_lock.release()
+    finally:
+        cancellations.finish(token)
+
+def decode_latents(pipeline, latents: torch.Tensor) -> List[Image.Image]:
+    decoded = pipeline.vae.decode(latents / pipeline.vae.config.scaling_factor, return_dict=False)[0]
+    return pipeline.image_processor.postprocess(decoded, output_type="pil")
+
+@torch.no_grad()
+def generate(pipeline, init_images: List[Image.Image], prompt: str, negative_prompt: str,
+             steps: int, cfg_scale: float, strength: float, cancel_token: Optional[CancelToken] = None,
+             acceleration: str = 'none', hires: Optional[HiresPlan] = None, refiner=None,
+             scheduler: Optional[str] = None, **pipeline_kwargs) -> List[Image.Image]:
+    """执行一次批量生成：VAE编码 → 文本编码 → 去噪 → VAE解码，各阶段可单独计时
+
+    同一批次的所有图像共用提示词，尺寸必须一致。
+    指定hires时在基础分辨率去噪后放大到输出分辨率，细化pass使用refiner (默认为同一管线)。
+    指定scheduler时本次生成临时使用该调度器。
+    """
+    refiner = refiner or pipeline
+    callback = cancel_token.step_callback if cancel_token else None
+    
+    with backend.autocast(), use_scheduler([pipeline, refiner], scheduler):
+        with phase("vae_encode"):
+            init_latents = torch.cat([latent_cache.get_or_encode(pipeline, image) for image in init_images])
+        
+        with phase("text_encode"):
+            prompt_embeds, negative_prompt_embeds = pipeline.encode_prompt(
+                prompt, pipeline.device, len(init_images), cfg_scale > 1.0, negative_prompt
+            )
+        
+        with phase("unet_steps"), accelerator.apply(pipeline, acceleration):
+            latents = pipeline(
+                prompt_embeds=prompt_embeds,
+                negative_prompt_embeds=negative_prompt_embeds,
+                image=init_latents,
+                strength=strength,
+                num_inference_steps=steps,
+                guidance_scale=cfg_scale,
+                output_type="latent",
+                callback_on_step_end=callback,
+                **pipeline_kwargs
+            ).images
+        
+        def refine(image):
+            """在输出分辨率上用少量步数细化，image可以是潜变量或像素图像"""
+            with phase("hires_steps"), accelerator.apply(refiner, acceleration):
+                return refiner(
+                    prompt_embeds=prompt_embeds,
+                    negative_prompt_embeds=negative_prompt_embeds,
+                    image=image,
+                    strength=hires.denoising_strength,
+                    num_inference_steps=hires.num_inference_steps,
+                    guidance_scale=cfg_scale,
+                    output_type="latent",
+                    callback_on_step_end=callback
+                ).images
+        
+        if hires is not None and hires.is_latent:
+            with phase("hires_upscale"):
+                latents = upscale_latents(latents, hires)
+            if hires.steps > 0:
+                latents = refine(latents)
+        
+        with phase("vae_decode"):
+            images = decode_latents(pipeline, latents)
+        
+        if hires is not None and not hires.is_latent:
+            with phase("hires_upscale"):
+                images = upscale_images(images, hires)
+            if hires.steps > 0:
+                latents = refine(images)
+                with phase("vae_decode"):
+                    images = decode_latents(pipeline, latents)
+    
+    return images
 
-def image_to_base64(image: Image.Image) -> str:
-    """将PIL图像转换为base64"""
-    buffer = io.BytesIO()
-    image.save(buffer, format='PNG')
-    return base64.b64encode(buffer.getvalue()).decode()
+def verify_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """校验管理接口令牌，未配置SD_ADMIN_TOKEN时管理接口不可用"""
+    expected = os.getenv('SD_ADMIN_TOKEN')
+    if not expected:
+        raise HTTPException(status_code=404, detail="管理接口未启用 (未配置SD_ADMIN_TOKEN)")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, expected):
+        raise HTTPException(status_code=403, detail="无权访问管理接口")
 
 @app.on_event("startup")
 async def startup_event():
     """服务启动时加载模型"""
-    if torch.cuda.is_available():
-        logger.info(f"检测到GPU: {torch.cuda.get_device_name()}")
-        load_models()
+    if backend.is_cpu:
+        logger.warning("未检测到GPU，使用CPU推理模式")
     else:
-        logger.warning("未检测到GPU，某些功能可能无法使用")
+        logger.info(f"检测到GPU: {torch.cuda.get_device_name()}")
+    load_models()
+    
+    # 配置了任务队列地址时，以worker身份从Bot的队列拉取任务
+    global queue_worker
+    queue_url = os.getenv('SD_QUEUE_URL')
+    if queue_url:
+        queue_worker = QueueWorker(queue_url, JOB_HANDLERS,
+                                   on_lease_lost=lambda job_id: cancellations.interrupt(job_id, "任务租约已失效"))
+        queue_worker.start()
+    
+    # 与Bot同机部署时，通过Unix域套接字和共享内存直接传递像素
+    global local_transport
+    socket_path = os.getenv('SD_LOCAL_SOCKET')
+    if socket_path:
+        local_transport = LocalTransportServer(
+            socket_path, dispatch_local,
+            on_disconnect=lambda job_id: cancellations.interrupt(job_id, "客户端已断开")
+        )
+        local_transport.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """停止队列worker和本机传输"""
+    if queue_worker is not None:
+        queue_worker.stop()
+    if local_transport is not None:
+        local_transport.stop()
 
 @app.get("/")
 async def root():
@@ -124,116 +337,316 @@ async def get_progress():
     """获取处理进度 (兼容Automatic1111 API)"""
     return ProgressResponse(progress=0.0, eta_relative=0.0)
 
-@app.post("/sdapi/v1/img2img")
-async def img2img(request: Img2ImgRequest):
-    """图像到图像转换API"""
-    global pipe
-    
-    if pipe is None:
-        raise HTTPException(status_code=503, detail="模型未加载")
+@app.get("/sdapi/v1/buckets")
+async def get_buckets():
+    """获取支持的分辨率桶，客户端据此选择最接近照片宽高比的尺寸"""
+    return {"buckets": [list(bucket) for bucket in resolution_buckets]}
+
+def run_img2img(request: Img2ImgRequest, acceleration: str, traceparent: Optional[str] = None,
+                cancel_token: Optional[CancelToken] = None, local: bool = False) -> dict:
+    """执行img2img生成 (同步，HTTP接口、队列worker和本机传输共用)
+
+    请求须已经过validate_request校验，acceleration为其返回的加速模式。
+    local为True时图像以共享内存引用传入和返回，不做base64/PNG编解码
+    """
+    if cancel_token is None:
+        cancel_token = cancellations.register(request.job_id, request.timeout)
     
-    try:
-        # 解码输入图像
-        if not request.init_images:
-            raise HTTPException(status_code=400, detail="需要提供初始图像")
+    with tracer.trace("img2img", traceparent, images=len(request.init_images), acceleration=acceleration), \
+            generation_slot(cancel_token), profiler.request():
+        pipe = get_pipeline(request.model)
+        request, hires, decision = adapt_quality(request, cancel_token)
         
-        init_image = base64_to_image(request.init_images[0])
-        init_image = init_image.resize((request.width, request.height))
+        with phase("shm_read" if local else "base64_decode"):
+            init_images = [decode_image(img, local) for img in request.init_images]
+        with phase("resize"):
+            init_images = [fit_to_size(img, request.width, request.height) for img in init_images]
         
-        logger.info(f"开始处理图像: {request.prompt}")
+        logger.info(f"开始处理图像 ({len(init_images)}张): {request.prompt}")
         
-        # 生成图像
-        with torch.autocast("cuda"):
-            result = pipe(
-                prompt=request.prompt,
-                negative_prompt=request.negative_prompt,
-                image=init_image,
-                strength=request.denoising_strength,
-                num_inference_steps=request.steps,
-                guidance_scale=request.cfg_scale,
-                width=request.width,
-                height=request.height
-            )
+        # 生成图像，多张输入作为一个批次
+        started = time.perf_counter()
+        images = generate(
+            pipe,
+            init_images,
+            prompt=request.prompt,
+            negative_prompt=request.negative_prompt,
+            steps=request.steps,
+            cfg_scale=request.cfg_scale,
+            strength=request.denoising_strength,
+            cancel_token=cancel_token,
+            acceleration=acceleration,
+            hires=hires,
+            scheduler=decision["scheduler"]
+        )
+        quality_controller.observe(quality_controller.request_work(request, hires),
+                                   time.perf_counter() - started, cancel_token.age)
         
         # 转换结果
-        output_images = []
-        for img in result.images:
-            output_images.append(image_to_base64(img))
+        with phase("shm_write" if local else "png_encode"):
+            output_images = [local_transport.write_image(img) if local else image_to_base64(img) for img in images]
+    
+    logger.info("图像处理完成")
+    
+    return {
+        "images": output_images,
+        "parameters": request.dict(),
+        "acceleration": acceleration,
+        "hires": hires.describe() if hires else None,
+        "quality_control": decision
+    }
+
+def run_controlnet(request: ControlNetRequest, acceleration: str, traceparent: Optional[str] = None,
+                   cancel_token: Optional[CancelToken] = None, local: bool = False) -> dict:
+    """执行ControlNet生成 (同步，HTTP接口、队列worker和本机传输共用)
+
+    请求须已经过validate_request校验，acceleration为其返回的加速模式。
+    """
+    if cancel_token is None:
+        cancel_token = cancellations.register(request.job_id, request.timeout)
+    
+    with tracer.trace("controlnet", traceparent, images=len(request.init_images), acceleration=acceleration), \
+            generation_slot(cancel_token), profiler.request():
+        controlnet_pipe = get_pipeline(request.model, controlnet=True)
+        request, hires, decision = adapt_quality(request, cancel_token)
         
-        logger.info("图像处理完成")
+        with phase("shm_read" if local else "base64_decode"):
+            init_images = [decode_image(img, local) for img in request.init_images]
+        with phase("resize"):
+            init_images = [fit_to_size(img, request.width, request.height) for img in init_images]
         
-        return {
-            "images": output_images,
-            "parameters": request.dict()
-        }
+        # 生成OpenPose
+        with phase("openpose"):
+            pose_images = [openpose(img) for img in init_images]
         
+        logger.info(f"开始ControlNet处理 ({len(init_images)}张): {request.prompt}")
+        
+        # 生成图像
+        started = time.perf_counter()
+        images = generate(
+            controlnet_pipe,
+            init_images,
+            prompt=request.prompt,
+            negative_prompt=request.negative_prompt,
+            steps=request.steps,
+            cfg_scale=request.cfg_scale,
+            strength=request.denoising_strength,
+            cancel_token=cancel_token,
+            acceleration=acceleration,
+            hires=hires,
+            # 细化pass使用共享组件的img2img管线，姿态已在基础分辨率确定
+            refiner=get_pipeline(request.model) if hires else None,
+            scheduler=decision["scheduler"],
+            control_image=pose_images,
+            width=request.width,
+            height=request.height,
+            controlnet_conditioning_scale=1.0
+        )
+        quality_controller.observe(quality_controller.request_work(request, hires),
+                                   time.perf_counter() - started, cancel_token.age)
+        
+        # 转换结果
+        with phase("shm_write" if local else "png_encode"):
+            output_images = [local_transport.write_image(img) if local else image_to_base64(img) for img in images]
+    
+    logger.info("ControlNet处理完成")
+    
+    return {
+        "images": output_images,
+        "parameters": request.dict(),
+        "acceleration": acceleration,
+        "hires": hires.describe() if hires else None,
+        "quality_control": decision
+    }
+
+# 队列worker可处理的任务类型，与HTTP接口路径一致
+# 任务ID即队列中的任务ID，租约失效或被取消时可以据此中断
+def _job_handler(request_class, runner):
+    def handle(payload: dict) -> dict:
+        request = request_class(**payload)
+        return runner(request, validate_request(request), payload.get('traceparent'))
+    return handle
+
+JOB_HANDLERS = {
+    "/sdapi/v1/img2img": _job_handler(Img2ImgRequest, run_img2img),
+    "/controlnet/img2img": _job_handler(ControlNetRequest, run_controlnet),
+}
+
+# 本机传输可处理的请求，与HTTP接口路径一致
+LOCAL_HANDLERS = {
+    "/sdapi/v1/img2img": (Img2ImgRequest, run_img2img),
+    "/controlnet/img2img": (ControlNetRequest, run_controlnet),
+}
+
+def dispatch_local(endpoint: str, payload: dict, traceparent: Optional[str]):
+    """处理本机传输的请求，返回(状态码, 响应体)，状态码与HTTP接口一致"""
+    if endpoint == "/sdapi/v1/interrupt":
+        job_id = payload.get("job_id")
+        return 200, {"interrupted": cancellations.interrupt(job_id), "job_id": job_id}
+    if endpoint not in LOCAL_HANDLERS:
+        return 404, {"detail": f"未知接口: {endpoint}"}
+    if model_pool is None:
+        return 503, {"detail": "模型未加载"}
+    
+    request_class, runner = LOCAL_HANDLERS[endpoint]
+    try:
+        request = request_class(**payload)
+        return 200, runner(request, validate_request(request), traceparent, local=True)
+    except HTTPException as e:
+        return e.status_code, {"detail": e.detail}
+    except GenerationCancelled as e:
+        logger.info(str(e))
+        return 409, {"detail": str(e)}
+    except ValueError as e:
+        return 400, {"detail": str(e)}
+    except Exception as e:
+        logger.error(f"本机传输请求处理失败: {e}")
+        return 500, {"detail": str(e)}
+
+async def run_cancellable(http_request: Request, runner, request, traceparent: Optional[str]) -> dict:
+    """校验参数后在线程池中运行生成任务，客户端断开连接时中断任务"""
+    acceleration = validate_request(request)
+    token = cancellations.register(request.job_id, request.timeout)
+    task = asyncio.ensure_future(run_in_threadpool(runner, request, acceleration, traceparent, token))
+    while not task.done():
+        await asyncio.wait({task}, timeout=0.5)
+        if not task.done() and not token.cancelled and await http_request.is_disconnected():
+            token.cancel("客户端已断开")
+    try:
+        return task.result()
+    finally:
+        # 生成任务在进入generation_slot之前失败时标记不会被释放
+        cancellations.finish(token)
+
+@app.post("/sdapi/v1/img2img")
+async def img2img(request: Img2ImgRequest, http_request: Request, traceparent: Optional[str] = Header(None)):
+    """图像到图像转换API"""
+    if model_pool is None:
+        raise HTTPException(status_code=503, detail="模型未加载")
+    
+    try:
+        # 在线程池中执行，生成期间事件循环仍可响应其他请求
+        return await run_cancellable(http_request, run_img2img, request, traceparent)
+    except HTTPException:
+        raise
+    except GenerationCancelled as e:
+        logger.info(str(e))
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         logger.error(f"图像处理失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/controlnet/img2img")
-async def controlnet_img2img(request: ControlNetRequest):
+async def controlnet_img2img(request: ControlNetRequest, http_request: Request,
+                             traceparent: Optional[str] = Header(None)):
     """ControlNet图像处理API"""
-    global controlnet_pipe, openpose
-    
-    if controlnet_pipe is None or openpose is None:
+    if model_pool is None or openpose is None:
         raise HTTPException(status_code=503, detail="ControlNet模型未加载")
     
     try:
-        # 解码输入图像
-        if not request.init_images:
-            raise HTTPException(status_code=400, detail="需要提供初始图像")
-        
-        init_image = base64_to_image(request.init_images[0])
-        init_image = init_image.resize((request.width, request.height))
-        
-        # 生成OpenPose
-        pose_image = openpose(init_image)
-        
-        logger.info(f"开始ControlNet处理: {request.prompt}")
-        
-        # 生成图像
-        with torch.autocast("cuda"):
-            result = controlnet_pipe(
-                prompt=request.prompt,
-                negative_prompt=request.negative_prompt,
-                image=init_image,
-                control_image=pose_image,
-                strength=request.denoising_strength,
-                num_inference_steps=request.steps,
-                guidance_scale=request.cfg_scale,
-                width=request.width,
-                height=request.height,
-                controlnet_conditioning_scale=1.0
-            )
-        
-        # 转换结果
-        output_images = []
-        for img in result.images:
-            output_images.append(image_to_base64(img))
-        
-        logger.info("ControlNet处理完成")
-        
-        return {
-            "images": output_images,
-            "parameters": request.dict()
-        }
-        
+        return await run_cancellable(http_request, run_controlnet, request, traceparent)
+    except HTTPException:
+        raise
+    except GenerationCancelled as e:
+        logger.info(str(e))
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         logger.error(f"ControlNet处理失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/sdapi/v1/interrupt")
+async def interrupt(request: Optional[InterruptRequest] = None):
+    """中断生成任务 (兼容Automatic1111)，未指定job_id时中断当前正在运行的任务"""
+    job_id = request.job_id if request else None
+    return {"interrupted": cancellations.interrupt(job_id), "job_id": job_id}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus格式的负载和质量控制指标"""
+    return quality_controller.metrics(cancellations.stats()["queued"])
+
+@app.get("/sdapi/v1/sd-models")
+async def list_models():
+    """列出可用模型及其所在层级 (device/host/disk)"""
+    if model_pool is None:
+        raise HTTPException(status_code=503, detail="模型未加载")
+    return {"default": model_pool.default_model, "models": model_pool.stats()}
+
+def preload_with_lock(models: List[str]):
+    with generation_lock:
+        model_pool.preload(models)
+
+@app.post("/sdapi/v1/models/preload")
+async def preload_models(request: PreloadRequest):
+    """预加载提示：提前把模型加载到设备或主机内存"""
+    if model_pool is None:
+        raise HTTPException(status_code=503, detail="模型未加载")
+    try:
+        # 加载checkpoint耗时较长，放到线程池执行；持有生成锁，避免淘汰正在生成的管线
+        await run_in_threadpool(preload_with_lock, request.models)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"models": model_pool.stats()}
+
+@app.post("/admin/profile", dependencies=[Depends(verify_admin_token)])
+async def start_profile(request: ProfileRequest):
+    """开始性能分析，覆盖接下来的N个请求或T秒"""
+    if request.requests is None and request.seconds is None:
+        raise HTTPException(status_code=400, detail="需要指定requests或seconds")
+    
+    try:
+        session = profiler.start(request.requests, request.seconds, request.torch_ops)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    # 按时间结束的会话即使没有请求也要按时写出
+    if request.seconds:
+        asyncio.get_running_loop().call_later(request.seconds, profiler.check_expired)
+    
+    return session.summary()
+
+@app.post("/admin/profile/stop", dependencies=[Depends(verify_admin_token)])
+async def stop_profile():
+    """提前结束当前性能分析"""
+    session = profiler.stop()
+    if session is None:
+        raise HTTPException(status_code=404, detail="没有进行中的分析会话")
+    return session.summary()
+
+@app.get("/admin/profile", dependencies=[Depends(verify_admin_token)])
+async def list_profiles():
+    """列出所有分析会话"""
+    profiler.check_expired()
+    return {
+        "active": profiler.session.id if profiler.session else None,
+        "sessions": [session.summary() for session in profiler.sessions.values()]
+    }
+
+@app.get("/admin/profile/{session_id}/download", dependencies=[Depends(verify_admin_token)])
+async def download_profile(session_id: str):
+    """下载分析结果 (cProfile统计、torch算子trace和阶段耗时)"""
+    archive_path = profiler.archive(session_id)
+    if archive_path is None:
+        raise HTTPException(status_code=404, detail="分析会话不存在或尚未结束")
+    return FileResponse(archive_path, filename=f"profile_{session_id}.zip")
+
 @app.get("/health")
 async def health_check():
     """健康检查"""
     gpu_available = torch.cuda.is_available()
-    models_loaded = pipe is not None and controlnet_pipe is not None
+    models_loaded = model_pool is not None and openpose is not None
     
     return {
-        "status": "healthy" if gpu_available and models_loaded else "degraded",
+        "status": "healthy" if models_loaded else "degraded",
         "gpu_available": gpu_available,
         "models_loaded": models_loaded,
-        "device": str(torch.cuda.get_device_name()) if gpu_available else "CPU"
+        "device": str(torch.cuda.get_device_name()) if not backend.is_cpu else "CPU",
+        "backend": backend.describe(),
+        "acceleration": accelerator.describe(),
+        "quality": quality_controller.stats(),
+        "latent_cache": latent_cache.stats(),
+        "models": model_pool.stats() if model_pool is not None else {},
+        "jobs": cancellations.stats()
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import queue
+import logging
+import secrets
+import threading
+import contextlib
+import contextvars
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bot和GPU服务共用的追踪实现：GPU服务镜像只包含gpu_server目录，因此放在这里，
+# Bot通过utils/tracing.py导入本模块。只依赖标准库，两侧都可以直接导入。
+
+# 跨服务传递追踪上下文的请求头 (W3C Trace Context)
+TRACE_HEADER = 'traceparent'
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar('current_span', default=None)
+
+class Span:
+    """一个计时区间，属于某个trace"""
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], spans: List["Span"],
+                 attributes: Dict[str, Any] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        # 同一trace的所有span共享一个列表，根span结束时一起导出
+        self._spans = spans
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6 if self.end_ns else None,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+def parse_traceparent(value: Optional[str]):
+    """解析traceparent头，返回(trace_id, parent_span_id)，格式不合法时返回None"""
+    if not value:
+        return None
+    parts = value.strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+class FileExporter:
+    """以JSON Lines格式把span追加写入本地文件"""
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def export(self, service_name: str, spans: List[Span]):
+        lines = [json.dumps({"service": service_name, **span.to_dict()}, ensure_ascii=False) for span in spans]
+        with self._lock, open(self.path, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+
+class OtlpExporter:
+    """通过OTLP/HTTP JSON把span发送到兼容的collector，后台线程发送不阻塞请求"""
+    def __init__(self, endpoint: str, max_queue: int = 1000):
+        self.url = endpoint.rstrip('/') + '/v1/traces'
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        threading.Thread(target=self._run, name="otlp-exporter", daemon=True).start()
+
+    def export(self, service_name: str, spans: List[Span]):
+        try:
+            self._queue.put_nowait((service_name, spans))
+        except queue.Full:
+            logger.warning("追踪导出队列已满，丢弃trace")
+
+    @staticmethod
+    def _attribute(key: str, value: Any) -> dict:
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def _payload(self, service_name: str, spans: List[Span]) -> dict:
+        otlp_spans = []
+        for record in spans:
+            item = {
+                "traceId": record.trace_id,
+                "spanId": record.span_id,
+                "name": record.name,
+                "kind": 1,
+                "startTimeUnixNano": str(record.start_ns),
+                "endTimeUnixNano": str(record.end_ns),
+                "attributes": [self._attribute(k, v) for k, v in record.attributes.items()],
+                "status": {"code": 2, "message": record.error} if record.error else {"code": 1},
+            }
+            if record.parent_id:
+                item["parentSpanId"] = record.parent_id
+            otlp_spans.append(item)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [self._attribute("service.name", service_name)]},
+            "scopeSpans": [{"scope": {"name": "ai-outfit"}, "spans": otlp_spans}],
+        }]}
+
+    def _run(self):
+        while True:
+            service_name, spans = self._queue.get()
+            request = urllib.request.Request(
+                self.url,
+                data=json.dumps(self._payload(service_name, spans)).encode(),
+                headers={"Content-Type": "application/json"},
+                method="POST"
+            )
+            try:
+                urllib.request.urlopen(request, timeout=10).close()
+            except Exception as e:
+                logger.warning(f"追踪导出失败: {e}")
+
+@contextlib.contextmanager
+def _run_span(span: Span, on_root_end=None):
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        span._spans.append(span)
+        _current_span.reset(token)
+        if on_root_end is not None:
+            on_root_end(list(span._spans))
+
+def span(name: str, **attributes):
+    """在当前trace中创建子span，不在trace中时返回空上下文，开销可以忽略"""
+    parent = _current_span.get()
+    if parent is None:
+        return contextlib.nullcontext()
+    return _run_span(Span(name, parent.trace_id, parent.span_id, parent._spans, attributes))
+
+def current_traceparent() -> Optional[str]:
+    """当前span的traceparent，用于传给下游服务"""
+    current = _current_span.get()
+    return current.traceparent if current is not None else None
+
+class Tracer:
+    """轻量级分布式追踪
+
+    Bot为每个Telegram update开始一个trace，通过traceparent请求头传给GPU服务器，
+    服务端延续该trace，两边的span使用同一个trace_id，便于定位端到端延迟耗在哪一段。
+    未配置导出器时trace()不会开启trace，其中的span()也都不记录。
+    """
+    def __init__(self, service_name: str, exporter=None):
+        self.service_name = service_name
+        self.exporter = exporter
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def _export(self, spans: List[Span]):
+        try:
+            self.exporter.export(self.service_name, spans)
+        except Exception as e:
+            logger.warning(f"追踪导出失败: {e}")
+
+    def trace(self, name: str, traceparent: Optional[str] = None, **attributes):
+        """开始一个trace的根span；传入上游的traceparent时延续上游trace"""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        parent = parse_traceparent(traceparent)
+        trace_id, parent_id = parent if parent else (secrets.token_hex(16), None)
+        return _run_span(Span(name, trace_id, parent_id, [], attributes), on_root_end=self._export)
+
+def create_tracer(service_name: str, exporter: Optional[str], file_path: str = None,
+                  otlp_endpoint: str = None) -> Tracer:
+    """按配置创建追踪器，exporter可选 none / file / otlp"""
+    exporter = (exporter or 'none').lower()
+    if exporter == 'file':
+        return Tracer(service_name, FileExporter(file_path or './traces.jsonl'))
+    if exporter == 'otlp':
+        return Tracer(service_name, OtlpExporter(otlp_endpoint or 'http://localhost:4318'))
+    return Tracer(service_name)
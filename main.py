@@ -1,3 +1,4 @@
+from utils.startup_timer import startup_timer
 import logging
 import os
 import asyncio
@@ -18,9 +19,13 @@ from bot.handlers import (
     handle_back_to_styles,
     handle_help,
     handle_status,
-    handle_unknown
+    handle_unknown,
+    get_ai_service,
+    prewarm
 )
 
+startup_timer.mark("导入模块")
+
 # 配置日志
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -35,6 +40,32 @@ def setup_directories():
         os.makedirs(directory, exist_ok=True)
     logger.info("目录设置完成")
 
+async def prewarm_in_background() -> None:
+    """连接成功后在后台预热模型，不阻塞处理/start等轻量请求"""
+    try:
+        await asyncio.to_thread(prewarm)
+        startup_timer.mark("后台预热")
+    except Exception as e:
+        logger.warning(f"预热失败，将在首次使用时加载: {e}")
+    startup_timer.log_report()
+
+async def post_init(application: Application) -> None:
+    """Bot连接后启动任务队列接口 (如果启用) 并开始后台预热"""
+    startup_timer.mark("连接Telegram")
+    
+    job_queue = getattr(get_ai_service(), 'job_queue', None)
+    if job_queue is not None:
+        from services.queue_server import start_queue_server
+        application.bot_data['queue_runner'] = await start_queue_server(job_queue)
+    
+    application.bot_data['prewarm_task'] = asyncio.create_task(prewarm_in_background())
+
+async def post_shutdown(application: Application) -> None:
+    """停止任务队列接口"""
+    runner = application.bot_data.get('queue_runner')
+    if runner is not None:
+        await runner.cleanup()
+
 def main():
     """主函数"""
     # 检查配置
@@ -46,7 +77,15 @@ def main():
     setup_directories()
     
     # 创建应用
-    application = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(Config.TELEGRAM_BOT_TOKEN)
+        # 并发处理update，生成期间仍能收到新照片并取消旧任务
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # 添加处理器
     
@@ -77,7 +116,12 @@ def main():
     
     logger.info("🤖 AI换装Bot启动中...")
     logger.info(f"🔗 Bot Token: {Config.TELEGRAM_BOT_TOKEN[:20]}...")
-    logger.info(f"🖥️  GPU服务器: {Config.GPU_SERVER_URL}")
+    if Config.JOB_QUEUE_ENABLED:
+        logger.info(f"📥 任务队列: {Config.JOB_QUEUE_DB} (worker接口端口 {Config.JOB_QUEUE_PORT})")
+    else:
+        logger.info(f"🖥️  GPU服务器: {Config.GPU_SERVER_URL}")
+    
+    startup_timer.mark("创建应用")
     
     # 启动Bot
     application.run_polling(
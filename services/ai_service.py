@@ -1,10 +1,15 @@
 import requests
 import io
+import time
 import base64
 from PIL import Image
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 import logging
 from config import Config
+from utils.image_processing import ImageProcessor
+from services.job_queue import JobQueue
+from services.local_transport import LocalTransportClient, LocalTransportUnavailable
+from utils.tracing import span, current_traceparent, TRACE_HEADER
 
 logger = logging.getLogger(__name__)
 
@@ -12,68 +17,264 @@ class AIStyleTransferService:
     def __init__(self):
         self.gpu_server_url = Config.GPU_SERVER_URL
         self.model_name = Config.STABLE_DIFFUSION_MODEL
+        self.image_processor = ImageProcessor()
+        self._buckets: Optional[List[Tuple[int, int]]] = None
+        # 上次获取分辨率桶失败的时间，退避期内直接使用默认尺寸
+        self._buckets_failed_at: Optional[float] = None
+        self.job_queue = JobQueue(Config.JOB_QUEUE_DB, Config.JOB_QUEUE_MAX_ATTEMPTS,
+                                  Config.JOB_QUEUE_RETENTION_SECONDS) if Config.JOB_QUEUE_ENABLED else None
+        self.local_transport = LocalTransportClient(Config.GPU_LOCAL_SOCKET)
+        
+    def _submit(self, endpoint: str, payload: Dict[str, Any], images: List[Image.Image],
+                timeout: float) -> Optional[Dict[str, Any]]:
+        """提交生成任务，返回结果 (images已解码为PIL图像)
+
+        与GPU服务器同机部署时通过本机传输直接传递像素，套接字不可用时回退到队列或HTTP
+        """
+        if self.local_transport.available():
+            try:
+                with span("transport", endpoint=endpoint, transport="local"):
+                    status, result = self.local_transport.submit(
+                        endpoint, payload, images, timeout, traceparent=current_traceparent()
+                    )
+                if status == 200:
+                    return result
+                if status == 409:
+                    logger.info(f"生成任务已被中断: {payload.get('job_id')}")
+                else:
+                    logger.error(f"AI服务请求失败: {status} {result.get('detail')}")
+                return None
+            except LocalTransportUnavailable as e:
+                logger.warning(f"本机传输不可用，回退到HTTP: {e}")
+            except OSError as e:
+                # 请求已经发出，GPU服务器可能仍在生成，不能再通过HTTP重复提交
+                logger.error(f"本机传输请求失败: {e}")
+                if payload.get('job_id'):
+                    self.interrupt(payload['job_id'])
+                return None
+        
+        with span("encode", images=len(images)):
+            payload = {**payload, "init_images": [self._image_to_base64(image) for image in images]}
+        
+        result = self._submit_remote(endpoint, payload, timeout)
+        if result:
+            with span("decode"):
+                result['images'] = [
+                    Image.open(io.BytesIO(base64.b64decode(img_b64)))
+                    for img_b64 in result.get('images', [])
+                ]
+        return result
+    
+    def _submit_remote(self, endpoint: str, payload: Dict[str, Any], timeout: float) -> Optional[Dict[str, Any]]:
+        """启用任务队列时写入队列等待worker处理，否则直接请求GPU服务器"""
+        if self.job_queue is not None:
+            with span("queue_wait", endpoint=endpoint):
+                job_id = self.job_queue.enqueue(endpoint, {**payload, "traceparent": current_traceparent()},
+                                                job_id=payload.get("job_id"))
+                return self.job_queue.wait_for(job_id, timeout)
+        
+        with span("transport", endpoint=endpoint):
+            headers = {}
+            traceparent = current_traceparent()
+            if traceparent:
+                headers[TRACE_HEADER] = traceparent
+            response = requests.post(f"{self.gpu_server_url}{endpoint}", json=payload, headers=headers, timeout=timeout)
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code == 409:
+                logger.info(f"生成任务已被中断: {payload.get('job_id')}")
+                return None
+        logger.error(f"AI服务请求失败: {response.status_code}")
+        return None
+    
+    def _hires_params(self, output_scale: Optional[float]) -> Dict[str, Any]:
+        """两阶段生成参数，放大倍数不大于1时不启用"""
+        scale = output_scale or Config.OUTPUT_SCALE
+        if scale <= 1.0:
+            return {}
+        return {
+            "enable_hr": True,
+            "hr_scale": scale,
+            "hr_upscaler": Config.HIRES_UPSCALER,
+            "hr_second_pass_steps": Config.HIRES_STEPS,
+        }
+    
+    def interrupt(self, job_id: str) -> bool:
+        """中断生成任务，用户发送新照片或重新选择服装时调用"""
+        try:
+            if self.job_queue is not None:
+                # worker下次心跳时发现租约失效，会在GPU服务器上中断该任务
+                self.job_queue.cancel(job_id)
+            if self.local_transport.available():
+                try:
+                    return self.local_transport.interrupt(job_id)
+                except LocalTransportUnavailable:
+                    pass
+            if self.job_queue is not None:
+                return True
+            response = requests.post(f"{self.gpu_server_url}/sdapi/v1/interrupt",
+                                     json={"job_id": job_id}, timeout=10)
+            return response.status_code == 200
+        except Exception as e:
+            logger.warning(f"中断任务 {job_id} 失败: {e}")
+            return False
+    
+    def get_resolution_buckets(self) -> List[Tuple[int, int]]:
+        """获取GPU服务器支持的分辨率桶，旧版本服务器或获取失败时回退到默认尺寸
+
+        失败后在BUCKET_RETRY_INTERVAL秒内不再重试，避免每个请求都等待超时。
+        """
+        if self._buckets is not None:
+            return self._buckets
+        if self._buckets_failed_at is not None and \
+                time.monotonic() - self._buckets_failed_at < Config.BUCKET_RETRY_INTERVAL:
+            return [Config.DEFAULT_RESOLUTION]
+
+        try:
+            response = requests.get(f"{self.gpu_server_url}/sdapi/v1/buckets", timeout=10)
+            if response.status_code == 200:
+                self._buckets = [tuple(b) for b in response.json()['buckets']]
+                self._buckets_failed_at = None
+                return self._buckets
+            logger.warning(f"GPU服务器不支持分辨率桶 ({response.status_code})，使用默认尺寸")
+        except Exception as e:
+            logger.warning(f"获取分辨率桶失败，使用默认尺寸: {e}")
+        self._buckets_failed_at = time.monotonic()
+        return [Config.DEFAULT_RESOLUTION]
+    
+    def _prepare_image(self, image: Image.Image) -> Tuple[Image.Image, Tuple[int, int]]:
+        """按宽高比选择分辨率桶，并在编码前缩放到桶尺寸"""
+        bucket = self.image_processor.closest_bucket(image.size, self.get_resolution_buckets())
+        return self.image_processor.fit_to_bucket(image, bucket), bucket
+    
+    def _plan_batches(self, images: List[Image.Image]) -> List[Tuple[Tuple[int, int], List[int]]]:
+        """按每张照片最接近的分辨率桶分组，每组再按MAX_BATCH_SIZE拆分，返回[(桶, 照片下标)]
+
+        同一批次必须使用相同尺寸；按各自的桶分组可以避免横竖混合的相册被大面积填充。
+        """
+        buckets = self.get_resolution_buckets()
+        groups: Dict[Tuple[int, int], List[int]] = {}
+        for i, image in enumerate(images):
+            groups.setdefault(self.image_processor.closest_bucket(image.size, buckets), []).append(i)
+        
+        size = max(1, Config.MAX_BATCH_SIZE)
+        return [(bucket, indices[start:start + size])
+                for bucket, indices in groups.items()
+                for start in range(0, len(indices), size)]
         
     def generate_outfit_change(self, 
                              person_image: Image.Image,
                              clothing_prompt: str,
                              style_prompt: str = "",
-                             negative_prompt: str = "blurry, low quality, distorted") -> Optional[Image.Image]:
+                             negative_prompt: str = "blurry, low quality, distorted",
+                             job_id: Optional[str] = None,
+                             output_scale: Optional[float] = None) -> Optional[Image.Image]:
         """使用AI生成换装效果"""
+        results = self.generate_outfit_change_batch(
+            [person_image], clothing_prompt, style_prompt, negative_prompt,
+            job_id=job_id, output_scale=output_scale
+        )
+        return results[0] if results else None
+    
+    def generate_outfit_change_batch(self,
+                                     person_images: List[Image.Image],
+                                     clothing_prompt: str,
+                                     style_prompt: str = "",
+                                     negative_prompt: str = "blurry, low quality, distorted",
+                                     job_id: Optional[str] = None,
+                                     output_scale: Optional[float] = None) -> List[Image.Image]:
+        """对一组照片使用同一套服装提示词生成，结果与输入顺序一致，任一批次失败时返回空列表
+
+        照片按分辨率桶分组并拆分为不超过MAX_BATCH_SIZE张的批次，依次请求GPU服务器。
+        各批次使用同一个job_id，中断时正在运行的批次返回409，后续批次不再提交。
+        output_scale大于1时在分辨率桶尺寸生成后放大输出，默认使用配置的OUTPUT_SCALE
+        """
         try:
-            # 准备请求数据
-            img_base64 = self._image_to_base64(person_image)
-            
-            payload = {
-                "init_images": [img_base64],
-                "prompt": f"{clothing_prompt}, {style_prompt}, high quality, detailed, realistic",
-                "negative_prompt": negative_prompt,
-                "steps": 30,
-                "cfg_scale": 7.5,
-                "width": 512,
-                "height": 768,
-                "denoising_strength": 0.7,
-                "sampler_name": "DPM++ 2M Karras"
-            }
-            
-            # 发送到GPU服务器
-            response = requests.post(
-                f"{self.gpu_server_url}/sdapi/v1/img2img",
-                json=payload,
-                timeout=120
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if 'images' in result and result['images']:
-                    # 解码第一张图像
-                    img_data = base64.b64decode(result['images'][0])
-                    return Image.open(io.BytesIO(img_data))
-            else:
-                logger.error(f"AI服务请求失败: {response.status_code}")
+            results: List[Optional[Image.Image]] = [None] * len(person_images)
+            for bucket, indices in self._plan_batches(person_images):
+                images = self._generate_batch(
+                    [person_images[i] for i in indices], bucket, clothing_prompt, style_prompt,
+                    negative_prompt, job_id, output_scale
+                )
+                if not images:
+                    return []
+                for i, image in zip(indices, images):
+                    results[i] = image
+            return results
                 
         except Exception as e:
             logger.error(f"AI换装生成失败: {e}")
             
-        return None
+        return []
+    
+    def _generate_batch(self,
+                        person_images: List[Image.Image],
+                        bucket: Tuple[int, int],
+                        clothing_prompt: str,
+                        style_prompt: str,
+                        negative_prompt: str,
+                        job_id: Optional[str],
+                        output_scale: Optional[float]) -> Optional[List[Image.Image]]:
+        """以一个批次请求生成，所有照片缩放到同一个分辨率桶"""
+        # 批次越大允许的时间越长，超时后GPU服务器也会丢弃该任务
+        timeout = 120 * len(person_images)
+        width, height = bucket
+        
+        with span("resize", images=len(person_images)):
+            person_images = [self.image_processor.fit_to_bucket(img, bucket) for img in person_images]
+        
+        payload = {
+            "prompt": f"{clothing_prompt}, {style_prompt}, high quality, detailed, realistic",
+            "negative_prompt": negative_prompt,
+            "steps": 30,
+            "cfg_scale": 7.5,
+            "width": width,
+            "height": height,
+            "denoising_strength": 0.7,
+            "sampler_name": "DPM++ 2M Karras",
+            "model": self.model_name,
+            "quality": Config.GENERATION_QUALITY,
+            "job_id": job_id,
+            "timeout": timeout,
+            **self._hires_params(output_scale)
+        }
+        
+        # 发送到GPU服务器
+        result = self._submit("/sdapi/v1/img2img", payload, person_images, timeout=timeout)
+        if not result:
+            return None
+        
+        decision = result.get('quality_control') or {}
+        if decision.get('level'):
+            logger.info(f"GPU服务器负载较高，已降级到质量档位 {decision['level']}: "
+                        f"{decision['steps']}步 {decision['width']}x{decision['height']}")
+        return result['images']
     
     def generate_with_controlnet(self,
                                person_image: Image.Image,
                                pose_image: Image.Image,
-                               clothing_prompt: str) -> Optional[Image.Image]:
+                               clothing_prompt: str,
+                               job_id: Optional[str] = None,
+                               output_scale: Optional[float] = None) -> Optional[Image.Image]:
         """使用ControlNet进行精确的换装生成"""
         try:
-            person_b64 = self._image_to_base64(person_image)
+            person_image, (width, height) = self._prepare_image(person_image)
+            pose_image = self.image_processor.fit_to_bucket(pose_image, (width, height), background=(0, 0, 0))
             pose_b64 = self._image_to_base64(pose_image)
             
             payload = {
-                "init_images": [person_b64],
                 "prompt": f"{clothing_prompt}, high quality, detailed, fashion photography",
                 "negative_prompt": "blurry, low quality, distorted, deformed",
                 "steps": 25,
                 "cfg_scale": 7.0,
-                "width": 512,
-                "height": 768,
+                "width": width,
+                "height": height,
                 "denoising_strength": 0.6,
+                "model": self.model_name,
+                "quality": Config.GENERATION_QUALITY,
+                "job_id": job_id,
+                "timeout": 150,
+                **self._hires_params(output_scale),
                 "controlnet_args": [
                     {
                         "input_image": pose_b64,
@@ -86,17 +287,10 @@ class AIStyleTransferService:
                 ]
             }
             
-            response = requests.post(
-                f"{self.gpu_server_url}/controlnet/img2img",
-                json=payload,
-                timeout=150
-            )
+            result = self._submit("/controlnet/img2img", payload, [person_image], timeout=150)
             
-            if response.status_code == 200:
-                result = response.json()
-                if 'images' in result and result['images']:
-                    img_data = base64.b64decode(result['images'][0])
-                    return Image.open(io.BytesIO(img_data))
+            if result and result['images']:
+                return result['images'][0]
                     
         except Exception as e:
             logger.error(f"ControlNet生成失败: {e}")
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from typing import Optional, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+STATUS_PENDING = 'pending'
+STATUS_LEASED = 'leased'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker_id TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+"""
+
+class JobQueue:
+    """基于SQLite的持久化任务队列
+
+    Bot把生成任务写入队列，GPU worker通过租约(lease)拉取任务：
+    租约期间需要定期心跳，超过可见性超时未心跳的任务会重新变为可领取，
+    失败或超时的任务在达到最大尝试次数前会自动重试。
+    结果被wait_for读取后删除；无人读取的已结束任务在retention秒后随下一次enqueue清理。
+    """
+    def __init__(self, db_path: str, max_attempts: int = 3, retention: float = 3600):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], job_id: Optional[str] = None) -> str:
+        """添加任务，返回任务ID；可以指定任务ID以便之后取消"""
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, payload, status, max_attempts, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), STATUS_PENDING, self.max_attempts, now, now)
+            )
+        return job_id
+
+    def _purge(self, now: float):
+        """删除超过保留期的已结束任务 (结果包含base64图像，不能无限保留)"""
+        cursor = self._conn.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+            (STATUS_DONE, STATUS_FAILED, now - self.retention)
+        )
+        if cursor.rowcount:
+            logger.info(f"已清理 {cursor.rowcount} 个过期任务")
+
+    def lease(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """领取最早的可用任务，包括租约已过期的任务"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire_leases(now)
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                    (STATUS_PENDING,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, worker_id = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (STATUS_LEASED, worker_id, now + lease_seconds, now, row['id'])
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        return {
+            "id": row['id'],
+            "kind": row['kind'],
+            "payload": json.loads(row['payload']),
+            "attempt": row['attempts'] + 1,
+            "lease_seconds": lease_seconds,
+        }
+
+    def _expire_leases(self, now: float):
+        """租约过期的任务重新排队，超过最大尝试次数的标记为失败"""
+        self._conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? "
+            "WHERE status = ? AND lease_expires < ? AND attempts >= max_attempts",
+            (STATUS_FAILED, "租约超时", now, STATUS_LEASED, now)
+        )
+        self._conn.execute(
+            "UPDATE jobs SET status = ?, worker_id = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE status = ? AND lease_expires < ?",
+            (STATUS_PENDING, now, STATUS_LEASED, now)
+        )
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """延长租约，租约已失效(被其他worker接管)时返回False"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? "
+                "WHERE id = ? AND worker_id = ? AND status = ? AND lease_expires >= ?",
+                (now + lease_seconds, now, job_id, worker_id, STATUS_LEASED, now)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]) -> bool:
+        """提交任务结果"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, lease_expires = NULL, updated_at = ? "
+                "WHERE id = ? AND worker_id = ? AND status = ?",
+                (STATUS_DONE, json.dumps(result), time.time(), job_id, worker_id, STATUS_LEASED)
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        """报告任务失败，未达到最大尝试次数时重新排队"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN ? ELSE ? END, "
+                "worker_id = NULL, lease_expires = NULL, error = ?, updated_at = ? "
+                "WHERE id = ? AND worker_id = ? AND status = ?",
+                (STATUS_FAILED, STATUS_PENDING, error, now, job_id, worker_id, STATUS_LEASED)
+            )
+        return cursor.rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """查询任务状态和结果"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row['id'],
+            "status": row['status'],
+            "attempts": row['attempts'],
+            "result": json.loads(row['result']) if row['result'] else None,
+            "error": row['error'],
+        }
+
+    def wait_for(self, job_id: str, timeout: float, poll_interval: float = 0.5) -> Optional[Dict[str, Any]]:
+        """阻塞等待任务结束，返回结果；失败或超时返回None"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = self.get(job_id)
+            if job is None:
+                return None
+            if job['status'] == STATUS_DONE:
+                self.delete(job_id)
+                return job['result']
+            if job['status'] == STATUS_FAILED:
+                logger.error(f"任务 {job_id} 失败: {job['error']}")
+                self.delete(job_id)
+                return None
+            time.sleep(poll_interval)
+
+        logger.error(f"等待任务 {job_id} 超时")
+        self.cancel(job_id)
+        return None
+
+    def cancel(self, job_id: str):
+        """取消尚未完成的任务，避免无人等待的任务继续占用GPU"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ? AND status IN (?, ?)",
+                (STATUS_FAILED, "已取消", time.time(), job_id, STATUS_PENDING, STATUS_LEASED)
+            )
+
+    def delete(self, job_id: str):
+        """删除已结束的任务"""
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ? AND status IN (?, ?)",
+                               (job_id, STATUS_DONE, STATUS_FAILED))
+
+    def stats(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row['status']: row['n'] for row in rows}
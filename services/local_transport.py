@@ -0,0 +1,116 @@
+import os
+import json
+import struct
+import socket
+import logging
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# 与GPU服务器的gpu_server/local_transport.py保持一致
+# 复制式传输：像素在写入和读取共享内存时各复制一次，省去的是PNG编解码、base64和HTTP
+SHM_PREFIX = 'shm://'
+_FRAME_HEADER = struct.Struct('!I')
+
+def _send_message(sock: socket.socket, message: dict):
+    data = json.dumps(message).encode()
+    sock.sendall(_FRAME_HEADER.pack(len(data)) + data)
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(size - len(buffer))
+        if not chunk:
+            raise ConnectionError("GPU服务器关闭了本机传输连接")
+        buffer += chunk
+    return bytes(buffer)
+
+def _recv_message(sock: socket.socket) -> dict:
+    size = _FRAME_HEADER.unpack(_recv_exact(sock, _FRAME_HEADER.size))[0]
+    return json.loads(_recv_exact(sock, size))
+
+def _write_image(image: Image.Image) -> Tuple[shared_memory.SharedMemory, str]:
+    """把图像原始像素写入共享内存，返回(共享内存, 引用)，请求结束后由调用方删除"""
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    data = image.tobytes()
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    shm.buf[:len(data)] = data
+    return shm, f"{SHM_PREFIX}{shm.name}/{image.width}x{image.height}"
+
+def _read_image(ref: str) -> Image.Image:
+    """读取GPU服务器写入的结果图像并删除共享内存"""
+    name, size = ref[len(SHM_PREFIX):].rsplit('/', 1)
+    width, height = (int(v) for v in size.split('x'))
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return Image.frombytes('RGB', (width, height), shm.buf)
+    finally:
+        shm.close()
+        shm.unlink()
+
+class LocalTransportUnavailable(Exception):
+    """请求发出之前本机传输就不可用 (套接字不存在、连接被拒绝、共享内存不足)，可以安全地改用HTTP"""
+
+class LocalTransportClient:
+    """与同机GPU服务器的本机传输 (Unix域套接字 + 共享内存图像)
+
+    图像以原始像素通过共享内存传递，不经过PNG编码、base64和HTTP。
+    套接字不存在时 (远程部署) available() 返回False，调用方回退到HTTP。
+    """
+    def __init__(self, socket_path: Optional[str]):
+        self.socket_path = socket_path
+
+    def available(self) -> bool:
+        return bool(self.socket_path) and os.path.exists(self.socket_path)
+
+    def _request(self, message: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """发送一条请求并等待响应
+
+        连接失败时抛出LocalTransportUnavailable；请求发出之后的超时和断开照常抛出OSError，
+        此时GPU服务器可能仍在处理，调用方不应再通过其他传输重复提交。
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            try:
+                sock.connect(self.socket_path)
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                raise LocalTransportUnavailable(str(e)) from e
+            _send_message(sock, message)
+            return _recv_message(sock)
+
+    def submit(self, endpoint: str, payload: Dict[str, Any], images: List[Image.Image],
+               timeout: float, traceparent: Optional[str] = None) -> Tuple[int, Dict[str, Any]]:
+        """发送生成请求，返回(状态码, 响应体)，响应体中的images已读取为PIL图像"""
+        buffers = []
+        try:
+            refs = []
+            for image in images:
+                try:
+                    shm, ref = _write_image(image)
+                except OSError as e:
+                    raise LocalTransportUnavailable(f"无法创建共享内存: {e}") from e
+                buffers.append(shm)
+                refs.append(ref)
+
+            response = self._request({
+                "endpoint": endpoint,
+                "payload": {**payload, "init_images": refs},
+                "traceparent": traceparent,
+            }, timeout)
+        finally:
+            for shm in buffers:
+                shm.close()
+                shm.unlink()
+
+        body = response['body']
+        if response['status'] == 200:
+            body['images'] = [_read_image(ref) for ref in body.get('images', [])]
+        return response['status'], body
+
+    def interrupt(self, job_id: str, timeout: float = 10) -> bool:
+        """通过本机传输中断生成任务"""
+        response = self._request({"endpoint": "/sdapi/v1/interrupt", "payload": {"job_id": job_id}}, timeout)
+        return response['status'] == 200 and response['body'].get('interrupted', False)
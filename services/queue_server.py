@@ -0,0 +1,67 @@
+import logging
+import secrets
+from aiohttp import web
+from config import Config
+from services.job_queue import JobQueue
+
+logger = logging.getLogger(__name__)
+
+def create_queue_app(queue: JobQueue) -> web.Application:
+    """创建供GPU worker拉取任务的HTTP接口"""
+
+    @web.middleware
+    async def auth_middleware(request: web.Request, handler):
+        token = request.headers.get('X-Queue-Token', '')
+        if Config.JOB_QUEUE_TOKEN and not secrets.compare_digest(token, Config.JOB_QUEUE_TOKEN):
+            return web.json_response({"detail": "无权访问任务队列"}, status=403)
+        return await handler(request)
+
+    async def lease(request: web.Request) -> web.Response:
+        body = await request.json()
+        job = queue.lease(body['worker_id'], float(body.get('lease_seconds', Config.JOB_QUEUE_LEASE_SECONDS)))
+        if job is None:
+            return web.Response(status=204)
+        return web.json_response(job)
+
+    async def heartbeat(request: web.Request) -> web.Response:
+        body = await request.json()
+        ok = queue.heartbeat(request.match_info['job_id'], body['worker_id'],
+                             float(body.get('lease_seconds', Config.JOB_QUEUE_LEASE_SECONDS)))
+        return web.json_response({"ok": ok}, status=200 if ok else 409)
+
+    async def result(request: web.Request) -> web.Response:
+        body = await request.json()
+        ok = queue.complete(request.match_info['job_id'], body['worker_id'], body['result'])
+        return web.json_response({"ok": ok}, status=200 if ok else 409)
+
+    async def fail(request: web.Request) -> web.Response:
+        body = await request.json()
+        ok = queue.fail(request.match_info['job_id'], body['worker_id'], body.get('error', ''))
+        return web.json_response({"ok": ok}, status=200 if ok else 409)
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(queue.stats())
+
+    app = web.Application(middlewares=[auth_middleware], client_max_size=64 * 1024 * 1024)
+    app.router.add_post('/jobs/lease', lease)
+    app.router.add_post('/jobs/{job_id}/heartbeat', heartbeat)
+    app.router.add_post('/jobs/{job_id}/result', result)
+    app.router.add_post('/jobs/{job_id}/fail', fail)
+    app.router.add_get('/jobs/stats', stats)
+    return app
+
+async def start_queue_server(queue: JobQueue) -> web.AppRunner:
+    """在当前事件循环中启动任务队列接口
+
+    任务中包含用户照片，未配置JOB_QUEUE_TOKEN时只监听本机地址，远程worker需要配置令牌。
+    """
+    host = Config.HOST
+    if not Config.JOB_QUEUE_TOKEN:
+        host = '127.0.0.1'
+        logger.warning("未配置JOB_QUEUE_TOKEN，任务队列接口只监听本机地址")
+    runner = web.AppRunner(create_queue_app(queue))
+    await runner.setup()
+    site = web.TCPSite(runner, host, Config.JOB_QUEUE_PORT)
+    await site.start()
+    logger.info(f"任务队列接口已启动: {host}:{Config.JOB_QUEUE_PORT}")
+    return runner
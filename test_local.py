@@ -19,7 +19,7 @@ logger = logging.getLogger(__name__)
 class MockAIService:
     """模拟AI服务，用于测试"""
     
-    def generate_outfit_change(self, person_image, clothing_prompt, style_prompt=""):
+    def generate_outfit_change(self, person_image, clothing_prompt, style_prompt="", job_id=None):
         """生成模拟的换装效果"""
         logger.info(f"模拟AI处理: {clothing_prompt}, {style_prompt}")
         
@@ -49,6 +49,14 @@ class MockAIService:
         
         return result_image
     
+    def generate_outfit_change_batch(self, person_images, clothing_prompt, style_prompt="", job_id=None):
+        """生成模拟的批量换装效果"""
+        return [self.generate_outfit_change(image, clothing_prompt, style_prompt) for image in person_images]
+    
+    def interrupt(self, job_id):
+        """模拟中断任务"""
+        return True
+    
     def check_service_health(self):
         """模拟健康检查"""
         return True
@@ -1,17 +1,21 @@
-import cv2
-import numpy as np
 from PIL import Image
 import io
 import base64
-from rembg import remove
-from typing import Tuple, Optional
+from typing import List, Tuple, Optional
 import logging
+import math
 
 logger = logging.getLogger(__name__)
 
+# cv2、numpy和rembg(onnxruntime)在首次使用时才导入，避免拖慢Bot启动
+
+# 结果发送支持的有损格式 (名称 -> PIL格式)，PNG等格式会忽略quality参数，无法控制体积
+DELIVERY_FORMATS = {'JPEG': 'JPEG', 'JPG': 'JPEG', 'WEBP': 'WEBP'}
+
 class ImageProcessor:
     def __init__(self):
         self.max_size = (1024, 1024)
+        self._rembg_session = None
     
     def resize_image(self, image: Image.Image, max_size: Tuple[int, int] = None) -> Image.Image:
         """调整图像大小，保持宽高比"""
@@ -32,6 +36,54 @@ class ImageProcessor:
         
         return image
     
+    def closest_bucket(self, size: Tuple[int, int], buckets: List[Tuple[int, int]]) -> Tuple[int, int]:
+        """选择宽高比最接近的分辨率桶"""
+        aspect = math.log(size[0] / size[1])
+        return min(buckets, key=lambda b: abs(math.log(b[0] / b[1]) - aspect))
+    
+    def fit_to_bucket(self, image: Image.Image, bucket: Tuple[int, int],
+                      background: Tuple[int, int, int] = (255, 255, 255)) -> Image.Image:
+        """缩放并填充到分辨率桶尺寸，透明背景合成到纯色背景上
+
+        缩放和填充方式与GPU服务器的gpu_server/resolution_buckets.py的fit_to_size保持一致。
+        """
+        width, height = bucket
+        
+        # 透明区域合成到背景色，避免发送RGBA
+        if image.mode in ('RGBA', 'LA'):
+            flattened = Image.new('RGB', image.size, background)
+            flattened.paste(image, mask=image.getchannel('A'))
+            image = flattened
+        else:
+            image = image.convert('RGB')
+        
+        if image.size == (width, height):
+            return image
+        
+        # 保持宽高比缩放，剩余部分居中填充
+        scale = min(width / image.width, height / image.height)
+        new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        resized = image.resize(new_size, Image.Resampling.LANCZOS)
+        if new_size == (width, height):
+            return resized
+        
+        canvas = Image.new('RGB', (width, height), background)
+        canvas.paste(resized, ((width - new_size[0]) // 2, (height - new_size[1]) // 2))
+        return canvas
+    
+    def _get_rembg_session(self):
+        """创建并复用rembg会话 (加载ONNX模型)"""
+        if self._rembg_session is None:
+            from rembg import new_session
+            self._rembg_session = new_session()
+        return self._rembg_session
+    
+    def warmup(self):
+        """预热：导入图像处理依赖并加载背景移除模型"""
+        import cv2
+        import numpy
+        self._get_rembg_session()
+    
     def remove_background(self, image: Image.Image) -> Image.Image:
         """使用rembg移除背景"""
         try:
@@ -40,8 +92,9 @@ class ImageProcessor:
             image.save(img_byte_arr, format='PNG')
             img_byte_arr = img_byte_arr.getvalue()
             
-            # 移除背景
-            output = remove(img_byte_arr)
+            # 移除背景，复用同一个会话避免每次重新加载模型
+            from rembg import remove
+            output = remove(img_byte_arr, session=self._get_rembg_session())
             
             # 转换回PIL Image
             result = Image.open(io.BytesIO(output))
@@ -50,8 +103,15 @@ class ImageProcessor:
             logger.error(f"背景移除失败: {e}")
             return image.convert('RGBA')
     
+    def preprocess_batch(self, images: List[Image.Image]) -> List[Image.Image]:
+        """批量预处理 (缩放 + 背景移除)，共享同一个背景移除会话"""
+        return [self.remove_background(self.resize_image(image)) for image in images]
+    
     def extract_person_mask(self, image: Image.Image) -> Image.Image:
         """提取人物遮罩"""
+        import cv2
+        import numpy as np
+        
         # 转换为OpenCV格式
         cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
         
@@ -100,6 +160,9 @@ class ImageProcessor:
     
     def enhance_image(self, image: Image.Image) -> Image.Image:
         """图像增强处理"""
+        import cv2
+        import numpy as np
+        
         # 转换为OpenCV格式
         cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
         
@@ -123,4 +186,33 @@ class ImageProcessor:
         """将base64字符串转换为PIL图像"""
         img_data = base64.b64decode(base64_str)
         image = Image.open(io.BytesIO(img_data))
-        return image
\ No newline at end of file
+        return image
+
+    def encode_for_delivery(self, image: Image.Image, image_format: str = 'JPEG',
+                            max_bytes: int = 800 * 1024, max_side: int = 2560) -> bytes:
+        """编码发送给用户的结果图像：Telegram会重新压缩照片，无需上传无损PNG
+
+        二分查找不超过max_bytes的最高质量，最长边超过max_side时先缩小
+        """
+        image_format = image_format.upper()
+        if image_format not in DELIVERY_FORMATS:
+            raise ValueError(f"不支持的发送格式: {image_format}，可选: {', '.join(DELIVERY_FORMATS)}")
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image = self.resize_image(image, (max_side, max_side))
+
+        def encode(quality: int) -> bytes:
+            buffer = io.BytesIO()
+            image.save(buffer, format=DELIVERY_FORMATS[image_format], quality=quality)
+            return buffer.getvalue()
+
+        low, high = 40, 95
+        best = encode(low)
+        while low <= high:
+            quality = (low + high) // 2
+            data = encode(quality)
+            if len(data) <= max_bytes:
+                best, low = data, quality + 1
+            else:
+                high = quality - 1
+        return best
@@ -0,0 +1,30 @@
+import time
+import logging
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+class StartupTimer:
+    """记录进程启动各阶段的时间点，用于输出启动耗时报告"""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.marks: List[Tuple[str, float]] = []
+
+    def mark(self, name: str):
+        """记录一个阶段完成的时间点"""
+        self.marks.append((name, time.perf_counter()))
+
+    def report(self) -> str:
+        """生成各阶段耗时报告"""
+        lines = ["⏱️ 启动耗时报告:"]
+        previous = self.started
+        for name, timestamp in self.marks:
+            lines.append(f"  {name:<24}{(timestamp - previous) * 1000:>8.0f} ms  (累计 {(timestamp - self.started) * 1000:.0f} ms)")
+            previous = timestamp
+        return "\n".join(lines)
+
+    def log_report(self):
+        logger.info(self.report())
+
+# 进程级启动计时器，在main模块最先导入
+startup_timer = StartupTimer()
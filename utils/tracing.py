@@ -0,0 +1,37 @@
+import functools
+from typing import Optional
+
+# 追踪实现与GPU服务共用 (gpu_server/tracing.py)，这里只补充Bot侧的Telegram处理函数装饰器
+from gpu_server.tracing import (
+    TRACE_HEADER,
+    Span,
+    FileExporter,
+    OtlpExporter,
+    Tracer,
+    span,
+    current_traceparent,
+    create_tracer as _create_tracer,
+)
+
+__all__ = [
+    'TRACE_HEADER', 'Span', 'FileExporter', 'OtlpExporter', 'Tracer', 'BotTracer',
+    'span', 'current_traceparent', 'create_tracer',
+]
+
+class BotTracer(Tracer):
+    """Bot侧追踪器，每个Telegram update一个trace"""
+    def traced(self, name: str):
+        """装饰Telegram处理函数，每个update一个trace"""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(update, context):
+                with self.trace(name, update_id=update.update_id):
+                    return await func(update, context)
+            return wrapper
+        return decorator
+
+def create_tracer(service_name: str, exporter: Optional[str], file_path: str = None,
+                  otlp_endpoint: str = None) -> BotTracer:
+    """按配置创建追踪器，exporter可选 none / file / otlp"""
+    tracer = _create_tracer(service_name, exporter, file_path, otlp_endpoint)
+    return BotTracer(tracer.service_name, tracer.exporter)